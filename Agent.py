@@ -22,10 +22,35 @@
 # These methods will be necessary for the project's main method to run.
 
 # Import Python library utility modules
-import datetime, sys, operator, copy
+import sys, operator, copy, atexit
+
+# Import NumPy for scoring all of the answers at once
+import numpy
 
 # Import required modules
-import helpers, knowledgebase, images
+import helpers, knowledgebase, images, instrumentation
+from relationships import Relationship
+
+# A knowledge base snapshot to start from, if it exists (see knowledgebase.savesnapshot)
+# The constructor can't take options, so set these before creating the Agent
+LOAD_KNOWLEDGE = None
+# Where to save a snapshot of the knowledge base when the program exits
+SAVE_KNOWLEDGE = None
+
+# The Agent whose scores go in the timing report, the last one created
+reportagent = None
+
+# Print the latencies and write the timing report of the whole run, once, when the program exits
+# The Project drivers can't be changed to do it themselves
+def savereport():
+    if reportagent is None:
+        return
+    # Let any debug renders finish first
+    images.waitforrenders()
+    # The percentiles cover every problem, so only calculate them this once
+    latencies = reportagent.scores.calculatelatencies()
+    print(reportagent.scores.latencyreport(latencies))
+    instrumentation.save(extra={'latencies':latencies})
         
 class Agent:
     # The default constructor for your Agent. Make sure to execute any
@@ -38,9 +63,28 @@ class Agent:
         self.scores = helpers.ScoreKeeper()
         # Store knowledge gained from previous problems
         self.knowledgebase = {}
-        
-        #from utils import fileutils
-        #self.knowledgebase = fileutils.load('knowledgebase')
+        # Start from an earlier run's knowledge, instead of learning it all again
+        snapshot = knowledgebase.loadsnapshot(LOAD_KNOWLEDGE)
+        if snapshot is not None:
+            self.knowledgebase = snapshot
+        if SAVE_KNOWLEDGE:
+            atexit.register(self.saveknowledge, SAVE_KNOWLEDGE)
+        # Write the timing report at exit, only once however many Agents there are
+        global reportagent
+        if reportagent is None:
+            atexit.register(savereport)
+        reportagent = self
+        # Set to an empty dict to also collect just the knowledge gained from the
+        # problems solved from now on (see knowledgebase.mergeknowledge)
+        self.newknowledge = None
+        # Relationships already found between pairs of figures in the current problem
+        self.relationshipcache = {}
+        # Indexes of the figures in the current problem (see indexfigure)
+        self.figureindexes = {}
+
+    # Save a snapshot of everything learned so far
+    def saveknowledge(self, path):
+        knowledgebase.savesnapshot(self.knowledgebase, path)
 
     # @param problem the RavensProblem your agent should solve
     # @return your Agent's answer to this problem
@@ -79,9 +123,6 @@ class Agent:
         #if self.scores.count >= 47:
         #    return '7'
             
-        # Remember the time when we started this problem
-        starttime = datetime.datetime.now()
-        
         # Change the problem structure to pythonized version
         prob = helpers.pythonizeproblem(problem)
         
@@ -93,8 +134,16 @@ class Agent:
         if not '2x1 Basic' in prob['name'] or not '16' in prob['name']:
            return '8'
         
+        # Time each stage of solving this problem
+        # The problem type for grouping latencies, for example '2x1 image' or '3x3 verbal'
+        problemtype = prob['type'].replace(' (Image)', '') + (' image' if 'images' in prob else ' verbal')
+        instrumentation.begin(prob['name'], problemtype)
+        # Remember the time when we started this problem
+        solvestart = instrumentation.start()
+        
         if 'images' in prob:
-            prob['figures'] = images.analyze(prob['images'])
+            with instrumentation.span('solve.analyze'):
+                prob['figures'] = images.analyze(prob['images'])
             
         prob['type'] = prob['type'].replace(' (Image)', '')
         
@@ -102,50 +151,65 @@ class Agent:
         print(prob['name'])
         
         # Update the problem details to make solving easier
-        self.preprocess(prob)
+        with instrumentation.span('solve.preprocess'):
+            self.preprocess(prob)
         
         # Update the knowledge base with this problem's attributes
-        knowledgebase.scanattributes(self.knowledgebase, prob)
-        knowledgebase.updateknowledge(self.knowledgebase)
+        with instrumentation.span('solve.knowledge'):
+            knowledgebase.scanattributes(self.knowledgebase, prob)
+            knowledgebase.updateknowledge(self.knowledgebase)
+            if self.newknowledge is not None:
+                knowledgebase.scanattributes(self.newknowledge, prob)
+        
+        # Relationships depend on the knowledge base, so only reuse them within this problem
+        self.relationshipcache = {}
+        self.figureindexes = {}
         
         # For 2x2 problems, detect the transpose relationship
         if prob['type'] == '2x2':
-            transpose = self.detecttranspose(prob)
+            with instrumentation.span('solve.transpose'):
+                transpose = self.detecttranspose(prob)
             if transpose == ('A', 'B'):
                 print('Re-formulating as A->B transpose')
                 # Swap B and C figures to represent the correct structure
                 prob['figures']['B'], prob['figures']['C'] = prob['figures']['C'], prob['figures']['B']
             
         # Change the object names to match up better
-        self.renameobjects(prob)
+        with instrumentation.span('solve.renameobjects'):
+            self.renameobjects(prob)
         
         # For 3x3 problems, score the answers based on how well
         # they match the vertical and horizontal invariants
         invariantscores = None
         if prob['type'] == '3x3':
-            invariantscores = self.scoreinvariants(prob)
+            with instrumentation.span('solve.scoreinvariants'):
+                invariantscores = self.scoreinvariants(prob)
         
         # For 3x3 problems, compress the structure into 2x3
         if prob['type'] == '3x3':
-            # Run the compression
-            self.compress(prob)
-            # Re-calculate the numeric values
-            self.addnumerics(prob)
+            with instrumentation.span('solve.compress'):
+                # Run the compression
+                self.compress(prob)
+                # Re-calculate the numeric values
+                self.addnumerics(prob)
         
         # Debugging code to view problem structure
         #from utils import fileutils
         #fileutils.dump(prob, prob['name'])
         
         # Come up with human-readable names for objects in figures
-        names = knowledgebase.findobjectnames(self.knowledgebase, prob)
+        with instrumentation.span('solve.objectnames'):
+            names = knowledgebase.findobjectnames(self.knowledgebase, prob)
         
         # Get the agent's answer to the problem
-        choice = self.chooseanswer(prob, invariantscores)
+        with instrumentation.span('solve.chooseanswer'):
+            choice = self.chooseanswer(prob, invariantscores)
+        self.relationshipcache = {}
+        self.figureindexes = {}
         
-        # Calculate the time spent and add it to the scores
-        endtime = datetime.datetime.now()
-        calctime = endtime - starttime
-        self.scores.addtime(prob['name'], calctime)
+        # Calculate the time spent and add it to the scores, along with each stage's time
+        calctime = instrumentation.stop('solve.answer', solvestart)
+        self.scores.addtime(prob['name'], calctime, problemtype, instrumentation.currentstages())
         
         # Add the correct answer info to the scores
         realanswer = problem.checkAnswer(choice)
@@ -159,7 +223,14 @@ class Agent:
         print('Chose %s %s' % (choice, status))
         
         # Analyze this answer to improve the knowledge base
-        knowledgebase.analyzeanswer(self.knowledgebase, prob, realanswer, self.diff_features)
+        with instrumentation.span('solve.learn'):
+            knowledgebase.analyzeanswer(self.knowledgebase, prob, realanswer, self.diff_features)
+            if self.newknowledge is not None:
+                knowledgebase.analyzeanswer(self.newknowledge, prob, realanswer, self.diff_features)
+        
+        # Finish this problem's stage timings, the report is written at exit (see savereport)
+        instrumentation.stop('solve', solvestart)
+        instrumentation.end()
         
         # Debugging for viewing knowledge base details, removed
         #from utils import fileutils
@@ -633,7 +704,8 @@ class Agent:
         lefts = ['H']
         ups = ['F']
         
-        scores = {}
+        answernames = []
+        answerinvariants = []
         # Go through all of the answer figures
         for figurename, figure in sorted(list(prob['figures'].items())):
             # Ignore figures that are not answers
@@ -651,9 +723,11 @@ class Agent:
             bothinvariants.extend(leftinvariants)
             bothinvariants.extend(upinvariants)
             
-            # Record the score for this answer
-            scores[figurename] = self.scorerelationships(allinvariants, bothinvariants)
+            answernames.append(figurename)
+            answerinvariants.append(bothinvariants)
         
+        # Score every answer against all of the invariants at once
+        scores = dict(zip(answernames, self.scorerelationshipbatch(allinvariants, answerinvariants)))
         return scores
         
     # Find relationships that repeat across all of the pairs of figures
@@ -673,9 +747,10 @@ class Agent:
                 
             # Filter the invariants based on these relationships
             filtered = []
+            invariantset = set(invariants)
             for relationship in relationships:
                 # Only include this relationship if it was in all other pairs
-                if relationship in invariants:
+                if relationship in invariantset:
                     filtered.append(relationship)
             
             # Set the invariants to this filtered list
@@ -985,274 +1060,289 @@ class Agent:
                     otherattributes[attribute] = newvalues
         return newfigure
         
+    # Score how well an object matches a new object
+    # Returns the score (1 if any attribute matches, otherwise 0) and the total priority of the matching attributes
+    # priorityvalues and relatives are the priority value and relative setting of each attribute
+    def scoreobjectanalogy(self, attributes, newattributes, priorityvalues, relatives):
+        score = 0
+        maxscore = 0
+        priority = 0
+        for attribute, value in list(attributes.items()):
+            if not attribute in newattributes:
+                # This attribute is not present in the other object, skip it
+                #maxscore += 1
+                continue
+            newvalue = newattributes[attribute]
+            priorityvalue = priorityvalues.get(attribute, 0)
+            relative = relatives[attribute]
+            if relative != 'never':
+                # This is a relative attribute, we can't verify the value directly
+                # because it relies on the object labels themselves
+                # Just match based on the number of values
+                if len(value) == len(newvalue):
+                    score += 1
+                    maxscore += 1
+                    priority += priorityvalue
+            elif value == newvalue:
+                # Exact match, add to the score
+                score += 1
+                maxscore += 1
+                priority += priorityvalue
+        if score > 0:
+            score = score / maxscore
+        return score, priority
+        
     # Find the best mapping between a base figure's objects and a new figure's objects
+    # Every pair of objects is scored once, then the pairs are chosen together so the
+    # mapping as a whole matches best (see helpers.bestassignment)
+    # Returns a list of (new object, object) pairs, best matches first
     def findobjectanalogies(self, figure, newfigure):
-        # Try to find a remapping between figure and newfigure for each object
-        analogies = {}
+        # Look up the priority value of each attribute, higher priority attributes are worth more
+        priorityranks = self.knowledgebase['attributepriorities']
+        priorityvalues = {}
+        for rank, attribute in enumerate(priorityranks):
+            priorityvalues.setdefault(attribute, len(priorityranks) - rank)
+        relatives = dict((attribute, details['relative']) for attribute, details in self.knowledgebase['attributes'].items())
+        
+        # Score every pair of objects
+        objectnames = list(figure.keys())
+        newobjectnames = list(newfigure.keys())
+        pairscores = []
+        for objectname in objectnames:
+            pairscores.append([self.scoreobjectanalogy(figure[objectname], newfigure[newobjectname], priorityvalues, relatives) for newobjectname in newobjectnames])
+        
+        # Matching one more pair of objects always beats any amount of priority,
+        # so give the score more weight than the highest total priority any mapping could have
+        scoreweight = 1 + sum(max([priority for score, priority in row] or [0]) for row in pairscores)
+        weights = [[score * scoreweight + priority for score, priority in row] for row in pairscores]
+        
+        # Put the best matches first, ties stay in figure order
+        pairs = helpers.bestassignment(weights)
+        pairs.sort(key=lambda pair: pairscores[pair[0]][pair[1]], reverse=True)
         analogylist = []
-        for _ in range(len(figure)):
-            # Keep track of the best match score and best match label
-            bestscore = -1
-            bestpriority = -1
-            bestmatch = None
-            
-            # Go through each object in the figure
-            for objectname, attributes in list(figure.items()):
-                if objectname in list(analogies.values()):
-                    # This object has already been mapped, skip it
-                    continue
-                for newobjectname, newattributes in list(newfigure.items()):
-                    if newobjectname in analogies:
-                        # This new object has already been mapped, skip it
-                        continue
-                    score = 0
-                    maxscore = 0
-                    priority = 0
-                    for attribute, value in list(attributes.items()):
-                        if not attribute in newattributes:
-                            # This attribute is not present in the other object, skip it
-                            #maxscore += 1
-                            continue
-                        newvalue = newattributes[attribute]
-                        priorityvalue = 0
-                        priorityranks = self.knowledgebase['attributepriorities']
-                        if attribute in priorityranks:
-                            priorityvalue = len(priorityranks) - priorityranks.index(attribute)
-                        relative = self.knowledgebase['attributes'][attribute]['relative']
-                        if relative != 'never':
-                            # This is a relative attribute, we can't verify the value directly
-                            # because it relies on the object labels themselves
-                            # Just match based on the number of values
-                            if len(value) == len(newvalue):
-                                score += 1
-                                maxscore += 1
-                                priority += priorityvalue
-                        elif value == newvalue:
-                            # Exact match, add to the score
-                            score += 1
-                            maxscore += 1
-                            priority += priorityvalue
-                    if score > 0:
-                        score = score / maxscore
-                    # Check to see if this is the best mapping found so far
-                    if score > bestscore or (score == bestscore and priority > bestpriority):
-                        bestscore = score
-                        bestpriority = priority
-                        bestmatch = (objectname, newobjectname)
-                            
-            
-            # Check if there was a best match
-            if bestmatch:
-                # Add the best match to the analogy list
-                bestobject, bestnewobject = bestmatch
-                analogies[bestnewobject] = bestobject
-                analogylist.append((bestnewobject, bestobject))
+        for row, column in pairs:
+            analogylist.append((newobjectnames[column], objectnames[row]))
         return analogylist
         
-    # Find all of the individual attribute relationships from a base figure to a new figure
+    # Make a hashable copy of everything in a figure, to tell figures with the same contents apart
+    # The objects and attributes stay in the order they're stored in, since the
+    # relationships (and the scores added up from them) come out in that order
+    def fingerprintfigure(self, figure):
+        return tuple((objectname, tuple((attribute, tuple(values)) for attribute, values in attributes.items())) for objectname, attributes in figure.items())
+        
+    # Compile a figure (from its fingerprint) into an index for finding relationships quickly
+    # Every attribute of every object is an entry, in the same order as the figure
+    # The index is kept for the rest of the problem, since most figures are compared more than once
+    def indexfigure(self, fingerprint):
+        index = self.figureindexes.get(fingerprint)
+        if index is not None:
+            return index
+        index = {}
+        index['count'] = len(fingerprint)
+        # Each attribute of each object, in order
+        index['entries'] = entries = []
+        # The entry positions of each attribute name
+        index['attributes'] = attributepositions = {}
+        # All of the values of each attribute name, from any object
+        index['values'] = attributevalues = {}
+        # The entry positions with each value, in any attribute
+        index['positions'] = valuepositions = {}
+        for objectname, attributelist in fingerprint:
+            attributes = dict(attributelist)
+            for attribute, values in attributelist:
+                position = len(entries)
+                entry = {}
+                entry['object'] = objectname
+                entry['attributes'] = attributes
+                entry['attribute'] = attribute
+                entry['values'] = values
+                entry['valueset'] = valueset = frozenset(values)
+                # Only numeric values can be modified by an amount
+                entry['numeric'] = all(value.isdigit() for value in values)
+                entry['number'] = None
+                if entry['numeric'] and len(values) == 1:
+                    entry['number'] = int(values[0])
+                entries.append(entry)
+                attributepositions.setdefault(attribute, []).append(position)
+                attributevalues.setdefault(attribute, set()).update(valueset)
+                for value in valueset:
+                    valuepositions.setdefault(value, set()).add(position)
+        self.figureindexes[fingerprint] = index
+        return index
+        
+    # Find the relationships between two figures, reusing them if the same two figures were
+    # already compared while solving this problem
+    # The same pairs come up again for every answer, swap and switch in chooseanswer
     def findfigurerelationships(self, figure, newfigure):
+        fingerprint = self.fingerprintfigure(figure)
+        newfingerprint = self.fingerprintfigure(newfigure)
+        key = (fingerprint, newfingerprint)
+        relationships = self.relationshipcache.get(key)
+        if relationships is None:
+            instrumentation.count('relationships.miss')
+            relationships = self.relatefigures(self.indexfigure(fingerprint), self.indexfigure(newfingerprint))
+            self.relationshipcache[key] = relationships
+        else:
+            instrumentation.count('relationships.hit')
+        # Give out a copy, so the cached list can't be changed
+        return list(relationships)
+        
+    # Find all of the individual attribute relationships from a base figure to a new figure
+    # Both figures are given as indexes (see indexfigure)
+    def relatefigures(self, index, newindex):
         relationships = []
         
         # Add a relationship for a match/mismatch on number of objects in the figure
-        if len(figure) == len(newfigure):
-            relationship = {}
-            relationship['oldobject'] = 'all'
-            relationship['newobject'] = 'all'
-            relationship['oldattribute'] = 'count'
-            relationship['newattribute'] = 'count'
-            relationship['type'] = 'exactmatch'
+        if index['count'] == newindex['count']:
+            relationship = Relationship('all', 'all', 'count', 'count', 'exactmatch')
             relationships.append(relationship)
         else:
-            relationship = {}
-            relationship['oldobject'] = 'all'
-            relationship['newobject'] = 'all'
-            relationship['oldattribute'] = 'count'
-            relationship['newattribute'] = 'count'
-            relationship['type'] = 'mismatch'
+            relationship = Relationship('all', 'all', 'count', 'count', 'mismatch')
             relationships.append(relationship)
-            relationshipcopy = relationship.copy()
             # Add a modification relationship for count mismatch
-            relationshipcopy['type'] = 'modification'
-            relationshipcopy['value'] = len(newfigure) - len(figure)
-            relationships.append(relationshipcopy)
+            relationships.append(relationship.retype('modification', value=newindex['count'] - index['count']))
             
         # Find all of the attribute values that were not in the original figure
         newvalueattributes = {}
-        for newobjectname, newattributes in list(newfigure.items()):
-            for newattribute, newvalues in list(newattributes.items()):
-                if newattribute in self.knowledgebase['attributes']:
-                    relative = self.knowledgebase['attributes'][newattribute]['relative']
-                    if relative != 'never':
-                        # Ignore attributes with relative values
-                        continue
-                # Check each of the values to see if they were in the original figure
-                for newvalue in newvalues:
-                    found = False
-                    for objectname, attributes in list(figure.items()):
-                        if not newattribute in attributes:
-                            # Attribute is missing, move on
-                            continue
-                        if newvalue in attributes[newattribute]:
-                            # Attribute with the same value was found
-                            found = True
-                            break
-                    if not found:
-                        # The value is completely new for this attribute
-                        if not newattribute in newvalueattributes:
-                            # This is the first new value for this attribute, create a list
-                            newvalueattributes[newattribute] = []
-                        # Add this new value to the list if it isn't already in it
-                        if not newvalue in newvalueattributes[newattribute]:
-                            newvalueattributes[newattribute].append(newvalue)
+        for newentry in newindex['entries']:
+            newattribute = newentry['attribute']
+            if newattribute in self.knowledgebase['attributes']:
+                relative = self.knowledgebase['attributes'][newattribute]['relative']
+                if relative != 'never':
+                    # Ignore attributes with relative values
+                    continue
+            # Check each of the values to see if they were in any object of the original figure
+            oldvalues = index['values'].get(newattribute, ())
+            for newvalue in newentry['values']:
+                if not newvalue in oldvalues:
+                    # The value is completely new for this attribute
+                    if not newattribute in newvalueattributes:
+                        # This is the first new value for this attribute, create a list
+                        newvalueattributes[newattribute] = []
+                    # Add this new value to the list if it isn't already in it
+                    if not newvalue in newvalueattributes[newattribute]:
+                        newvalueattributes[newattribute].append(newvalue)
                             
         # Add relationships for each new set of attribute values
         for newattributename, newvalues in list(newvalueattributes.items()):
-            relationship = {}
-            relationship['oldobject'] = 'all'
-            relationship['newobject'] = 'all'
-            relationship['oldattribute'] = newattributename
-            relationship['newattribute'] = newattributename
-            relationship['type'] = 'newvalues'
-            relationship['values'] = newvalues
+            relationship = Relationship('all', 'all', newattributename, newattributename, 'newvalues', values=newvalues)
             relationships.append(relationship)
             
         
         # Add relationships between every object in the figure and every object in the other figure
-        for objectname, attributes in list(newfigure.items()):
-        
+        otherentries = index['entries']
+        for entry in newindex['entries']:
+            objectname = entry['object']
+            attributes = entry['attributes']
+            attribute = entry['attribute']
+            values = entry['values']
+            valueset = entry['valueset']
+            
             # Check to see if this attribute doesn't even exist in the other figure
-            for attribute, values in list(attributes.items()):
-                missingattribute = True
-                for otherobjectname, otherattributes in list(figure.items()):
-                    if attribute in otherattributes:
-                        missingattribute = False
-                        break
-                        
-                if missingattribute:
-                    # Attribute is not in other figure, add as a relationship and move on
-                    relationship = {}
-                    relationship['oldobject'] = 'unknown'
-                    relationship['newobject'] = objectname
-                    relationship['oldattribute'] = 'unknown'
-                    relationship['newattribute'] = attribute
-                    relationship['type'] = 'missing'
-                    relationships.append(relationship)
-                    continue
+            samepositions = index['attributes'].get(attribute)
+            if not samepositions:
+                # Attribute is not in other figure, add as a relationship and move on
+                relationship = Relationship('unknown', objectname, 'unknown', attribute, 'missing')
+                relationships.append(relationship)
+                continue
+            
+            # Only the same attribute, or another attribute with all of these values (a cross-match),
+            # can be related to this attribute, so only look at those entries of the other figure
+            if valueset:
+                crosspositions = None
+                for value in valueset:
+                    positions = index['positions'].get(value, ())
+                    crosspositions = set(positions) if crosspositions is None else crosspositions.intersection(positions)
+            else:
+                # With no values, every other attribute has all of them
+                crosspositions = set(range(len(otherentries)))
+            # Keep the other figure's order, so the relationships come out in the same order
+            positions = sorted(crosspositions.union(samepositions))
+            
+            for position in positions:
+                otherentry = otherentries[position]
+                otherobjectname = otherentry['object']
+                otherattributes = otherentry['attributes']
+                otherattribute = otherentry['attribute']
+                othervalues = otherentry['values']
+                # The objects and attributes this relationship is between, its type is found below
+                endpoints = (otherobjectname, objectname, otherattribute, attribute)
                 
-                # Go through all of the objects in the other figure
-                for otherobjectname, otherattributes in list(figure.items()):
-                    for otherattribute, othervalues in list(otherattributes.items()):
-                        relationship = {}
-                        relationship['oldobject'] = otherobjectname
-                        relationship['newobject'] = objectname
-                        relationship['oldattribute'] = otherattribute
-                        relationship['newattribute'] = attribute
-                        relationship['type'] = 'unknown'
-                        
-                        # Check if the attribute is the same as this attribute
-                        sameattribute = (attribute == otherattribute)
+                # Check if the attribute is the same as this attribute
+                sameattribute = (attribute == otherattribute)
+                
+                # Check to see if the value matches or partially matches
+                samevalues = valueset.issubset(otherentry['valueset'])
+                somevalues = not valueset.isdisjoint(otherentry['valueset'])
+                allnumeric = entry['numeric'] and otherentry['numeric']
+                    
+                # Check to see if the number of values matches
+                countvalues = (len(values) == len(othervalues))
+                if sameattribute and samevalues:
+                    # Same attribute and value, this is an exact match
+                    relationships.append(Relationship(*endpoints, type='exactmatch'))
+                elif sameattribute and allnumeric and not samevalues and len(values) == 1 and len(othervalues) == 1:
+                    # Same attribute, with numeric values that are different, this is a modification
+                    relationships.append(Relationship(*endpoints, type='mismatch'))
+                    difference = otherentry['number'] - entry['number']
+                    # Specifically for angles, keep the difference within 360 degrees
+                    if attribute == 'angle':
+                        difference = difference % 360
+                    relationships.append(Relationship(*endpoints, type='modification', value=difference))
+                elif sameattribute and not samevalues and not somevalues:
+                    # Same attribute but completely different values, this is a mismatch
+                    relationships.append(Relationship(*endpoints, type='mismatch'))
+                    relationships.append(Relationship(*endpoints, type='newvalues', values=','.join(values)))
+                elif not sameattribute and samevalues:
+                    # Same value but different attribute, this is a cross-match
+                    relationships.append(Relationship(*endpoints, type='crossmatch'))
+                elif sameattribute and somevalues:
+                    # Same attribute but only some matching values, this is a partial match
+                    relationships.append(Relationship(*endpoints, type='partialmatch'))
+                elif sameattribute and countvalues:
+                    # Same attribute and count of values, this is a count match
+                    relationships.append(Relationship(*endpoints, type='countmatch'))
+                    
+                # Special logic for angle attribute values
+                # This whole section is a hack that doesn't work very well
+                # There are a few problems in the 20 given problems that require it
+                # The goal is to get those problems right without impacting the general logic
+                if sameattribute and attribute == 'angle':
+                    # Get the angle values (angle attribute is never multi-part)
+                    angle = int(values[0])
+                    otherangle = int(othervalues[0])
+                    
+                    # Calculate a visually observable angle for both objects
+                    visualangle = self.findvisualangle(attributes)
+                    othervisualangle = self.findvisualangle(otherattributes)
+                    adjustedobject = {'shape':attributes.get('shape'), 'angle':otherattributes.get('angle')}
+                    adjustedvisualangle = self.findvisualangle(adjustedobject)
+                    
+                    # Check for an exact visual angle match
+                    if visualangle == othervisualangle:
+                        relationships.append(Relationship(*endpoints, type='visualmatch'))
                         
-                        # Check to see if the value matches or partially matches
-                        samevalues = True
-                        somevalues = False
-                        allnumeric = True
-                        for value in values:
-                            if not value in othervalues:
-                                samevalues = False
-                            else:
-                                somevalues = True
-                            if not value.isdigit():
-                                allnumeric = False
-                        for othervalue in othervalues:
-                            if not othervalue.isdigit():
-                                allnumeric = False
-                            
-                        # Check to see if the number of values matches
-                        countvalues = (len(values) == len(othervalues))
-                        if sameattribute and samevalues:
-                            # Same attribute and value, this is an exact match
-                            relationship['type'] = 'exactmatch'
-                            relationships.append(relationship)
-                        elif sameattribute and allnumeric and not samevalues and len(values) == 1 and len(othervalues) == 1:
-                            # Same attribute, with numeric values that are different, this is a modification
-                            relationship['type'] = 'mismatch'
-                            relationships.append(relationship)
-                            relationshipcopy = relationship.copy()
-                            relationshipcopy['type'] = 'modification'
-                            relationshipcopy['value'] = int(othervalues[0]) - int(values[0])
-                            # Specifically for angles, keep the difference within 360 degrees
-                            if attribute == 'angle':
-                                relationshipcopy['value'] = (int(othervalues[0]) - int(values[0])) % 360
-                            relationships.append(relationshipcopy)
-                        elif sameattribute and not samevalues and not somevalues:
-                            # Same attribute but completely different values, this is a mismatch
-                            relationship['type'] = 'mismatch'
-                            relationships.append(relationship)
-                            relationshipcopy = relationship.copy()
-                            relationshipcopy['type'] = 'newvalues'
-                            relationshipcopy['values'] = ','.join(values)
-                            relationships.append(relationshipcopy)
-                        elif not sameattribute and samevalues:
-                            # Same value but different attribute, this is a cross-match
-                            relationship['type'] = 'crossmatch'
-                            relationships.append(relationship)
-                        elif sameattribute and somevalues:
-                            # Same attribute but only some matching values, this is a partial match
-                            relationship['type'] = 'partialmatch'
-                            relationships.append(relationship)
-                        elif sameattribute and countvalues:
-                            # Same attribute and count of values, this is a count match
-                            relationship['type'] = 'countmatch'
-                            relationships.append(relationship)
-                            
-                        # Special logic for angle attribute values
-                        # This whole section is a hack that doesn't work very well
-                        # There are a few problems in the 20 given problems that require it
-                        # The goal is to get those problems right without impacting the general logic
-                        if sameattribute and attribute == 'angle':
-                            # Get the angle values (angle attribute is never multi-part)
-                            angle = int(values[0])
-                            otherangle = int(othervalues[0])
-                            
-                            # Calculate a visually observable angle for both objects
-                            visualangle = self.findvisualangle(attributes)
-                            othervisualangle = self.findvisualangle(otherattributes)
-                            adjustedobject = {'shape':attributes.get('shape'), 'angle':otherattributes.get('angle')}
-                            adjustedvisualangle = self.findvisualangle(adjustedobject)
-                            
-                            # Check for an exact visual angle match
-                            if visualangle == othervisualangle:
-                                relationshipcopy = relationship.copy()
-                                relationshipcopy['type'] = 'visualmatch'
-                                relationships.append(relationshipcopy)
-                                
-                            # Check if the angle would be the same if the other shape was the same
-                            if visualangle == adjustedvisualangle:
-                                relationshipcopy = relationship.copy()
-                                relationshipcopy['type'] = 'adjustedmatch'
-                                relationships.append(relationshipcopy)
-                            
-                            # This is some reflection detection logic
-                            # It is very hacky and will not work in most cases
-                            # It is needed because 2 of the given problems prioritize reflection over rotation
-                            nonsymmetricalshapes = ['triangle', 'arrow', 'half-arrow', 'Pac-Man', 'right-triangle']
-                            nonsymmetrical = ','.join(attributes.get('shape')) in nonsymmetricalshapes
-                            arrow = (','.join(attributes.get('shape')) == 'arrow' or ','.join(attributes.get('shape')) == 'half-arrow')
-                            horizontalrefelction = (360 - otherangle) == angle or (360 - angle) == otherangle or angle == otherangle
-                            verticalangle = (angle + 90) % 360
-                            verticalotherangle = (otherangle + 90) % 360
-                            verticalreflection = (360 - verticalotherangle) == verticalangle or (360 - verticalangle) == verticalotherangle or verticalangle == verticalotherangle
-                            flipcorrect = (','.join(attributes.get('shape')) != 'half-arrow') or (attributes.get('vertical-flip') and 'yes' in attributes['vertical-flip'])
+                    # Check if the angle would be the same if the other shape was the same
+                    if visualangle == adjustedvisualangle:
+                        relationships.append(Relationship(*endpoints, type='adjustedmatch'))
+                    
+                    # This is some reflection detection logic
+                    # It is very hacky and will not work in most cases
+                    # It is needed because 2 of the given problems prioritize reflection over rotation
+                    nonsymmetricalshapes = ['triangle', 'arrow', 'half-arrow', 'Pac-Man', 'right-triangle']
+                    nonsymmetrical = ','.join(attributes.get('shape')) in nonsymmetricalshapes
+                    arrow = (','.join(attributes.get('shape')) == 'arrow' or ','.join(attributes.get('shape')) == 'half-arrow')
+                    horizontalrefelction = (360 - otherangle) == angle or (360 - angle) == otherangle or angle == otherangle
+                    verticalangle = (angle + 90) % 360
+                    verticalotherangle = (otherangle + 90) % 360
+                    verticalreflection = (360 - verticalotherangle) == verticalangle or (360 - verticalangle) == verticalotherangle or verticalangle == verticalotherangle
+                    flipcorrect = (','.join(attributes.get('shape')) != 'half-arrow') or (attributes.get('vertical-flip') and 'yes' in attributes['vertical-flip'])
 
-                            if horizontalrefelction and nonsymmetrical and flipcorrect:
-                                relationshipcopy = relationship.copy()
-                                relationshipcopy['type'] = 'horizontalreflectionmatch'
-                                relationships.append(relationshipcopy)
-                            if verticalreflection and nonsymmetrical and flipcorrect and arrow:
-                                relationshipcopy = relationship.copy()
-                                relationshipcopy['type'] = 'verticalreflectionmatch'
-                                relationships.append(relationshipcopy)      
-                            
+                    if horizontalrefelction and nonsymmetrical and flipcorrect:
+                        relationships.append(Relationship(*endpoints, type='horizontalreflectionmatch'))
+                    if verticalreflection and nonsymmetrical and flipcorrect and arrow:
+                        relationships.append(Relationship(*endpoints, type='verticalreflectionmatch'))
+                    
         return relationships
         
     # Figure out the visually observable angle for shapes with rotational symmetry
@@ -1277,93 +1367,127 @@ class Agent:
             
         return angle
         
-    # Score one set of relationships compared to another set of relationships
-    def scorerelationships(self, relationships, otherrelationships):
-        # Keep track of the score and the maximum possible score
-        score = 0
-        
-        # Start with a score of 1 if the relationships have the same number of entries
-        if len(relationships) == len(otherrelationships):
-            score += 1
-        maxscore = 1
-        
-        # Find all of the relationships in the first set that are also in the second set
-        for relationship in relationships:
-            # Weight each relationship entry based on the type
-            # These weights are partially common sense and partially
-            # tweaked to get the given problems correct
-            # Even without the weights, the agent performs pretty well
-            scoremod = 1
-            if relationship['type'] == 'partialmatch':
-                scoremod = 0.25
-            elif relationship['type'] == 'crossmatch':
-                scoremod = 0.05
-            elif relationship['type'] == 'newvalues':
-                scoremod = 0.15
-            elif relationship['type'] == 'modification':
-                scoremod = 0.25
-            elif relationship['type'] == 'horizontalreflectionmatch':
-                scoremod = 2
-            elif relationship['type'] == 'verticalreflectionmatch':
-                scoremod = 0.75
+    # Weigh how much a matching relationship adds to the score
+    # The weight only depends on the type and old attribute of the relationship
+    def weighrelationship(self, relationship):
+        # These weights are partially common sense and partially
+        # tweaked to get the given problems correct
+        # Even without the weights, the agent performs pretty well
+        scoremod = 1
+        if relationship['type'] == 'partialmatch':
+            scoremod = 0.25
+        elif relationship['type'] == 'crossmatch':
+            scoremod = 0.05
+        elif relationship['type'] == 'newvalues':
+            scoremod = 0.15
+        elif relationship['type'] == 'modification':
+            scoremod = 0.25
+        elif relationship['type'] == 'horizontalreflectionmatch':
+            scoremod = 2
+        elif relationship['type'] == 'verticalreflectionmatch':
+            scoremod = 0.75
                 
-            # Give a bonus for attributes that show up a lot
-            # This is mainly to give "shape" a lot of importance
-            # without having to hard-code anything special for shape
-            prioritybonus = 0
-            priorities = self.knowledgebase['attributepriorities']
-            if relationship['oldattribute'] in priorities:
-                priorityrank = priorities.index(relationship['oldattribute'])
-                if priorityrank == 0:
-                    prioritybonus = 1.5
-                elif priorityrank < 5:
-                    prioritybonus = 0.5 * (1.0/priorityrank)
+        # Give a bonus for attributes that show up a lot
+        # This is mainly to give "shape" a lot of importance
+        # without having to hard-code anything special for shape
+        prioritybonus = 0
+        priorities = self.knowledgebase['attributepriorities']
+        if relationship['oldattribute'] in priorities:
+            priorityrank = priorities.index(relationship['oldattribute'])
+            if priorityrank == 0:
+                prioritybonus = 1.5
+            elif priorityrank < 5:
+                prioritybonus = 0.5 * (1.0/priorityrank)
             
-            # Add an extra bonus for overall "count" relationships
-            if relationship['oldattribute'] == 'count':
-                prioritybonus += scoremod
-                # Add a huge bonus for count modification relationships
-                if relationship['type'] == 'modification':
-                    prioritybonus += 10
-            # Add a very huge bonus for angle XOR relationships
-            if relationship['oldattribute'] == 'anglexor':
-                prioritybonus += 25
-            scoremod += prioritybonus
+        # Add an extra bonus for overall "count" relationships
+        if relationship['oldattribute'] == 'count':
+            prioritybonus += scoremod
+            # Add a huge bonus for count modification relationships
+            if relationship['type'] == 'modification':
+                prioritybonus += 10
+        # Add a very huge bonus for angle XOR relationships
+        if relationship['oldattribute'] == 'anglexor':
+            prioritybonus += 25
+        scoremod += prioritybonus
                 
-            # Give a bonus to relative attributes, they are easier to match
-            if relationship['oldattribute'] in self.knowledgebase['attributes']:
-                relative = self.knowledgebase['attributes'][relationship['oldattribute']]['relative']
-                if relative != 'never':
-                    scoremod = scoremod * 4
-            maxscore += scoremod
+        # Give a bonus to relative attributes, they are easier to match
+        if relationship['oldattribute'] in self.knowledgebase['attributes']:
+            relative = self.knowledgebase['attributes'][relationship['oldattribute']]['relative']
+            if relative != 'never':
+                scoremod = scoremod * 4
+        return scoremod
+        
+    # Score one set of relationships compared to another set of relationships
+    def scorerelationships(self, relationships, otherrelationships):
+        return self.scorerelationshipbatch(relationships, [otherrelationships])[0]
+        
+    # Score one set of relationships compared to each of a list of other sets of relationships
+    # The first set is weighed once, then all of the other sets are scored together
+    # Returns a list of scores, one for each of the other sets
+    def scorerelationshipbatch(self, relationships, otherrelationshiplists):
+        if not otherrelationshiplists:
+            return []
             
-            # Check to see if this relationship is in the other set
-            if relationship in otherrelationships:
-                # We matched on this relationship, add the calculated mod to the total score
-                score += scoremod
-            else:
-                # Don't decrease the score based on mismatches, it doesn't help much
-                pass
-                #maxscore += scoremod
-                
-        # Give a small bonus to relationships in the second set that were also in the first set
-        for otherrelationship in otherrelationships:
-            scoremod = 0.05
-            maxscore += scoremod
-            if otherrelationship in relationships:
-                score += scoremod
+        # Give each different relationship in the first set a column, and weigh every relationship
+        # Many relationships share a type and attribute, only weigh each combination once
+        columns = {}
+        relationshipcolumns = numpy.empty(len(relationships), dtype=numpy.intp)
+        weights = numpy.empty(len(relationships))
+        typeweights = {}
+        for position, relationship in enumerate(relationships):
+            weightkey = (relationship.type, relationship.oldattribute)
+            scoremod = typeweights.get(weightkey)
+            if scoremod is None:
+                scoremod = typeweights[weightkey] = self.weighrelationship(relationship)
+            weights[position] = scoremod
+            relationshipcolumns[position] = columns.setdefault(relationship, len(columns))
             
-        # Normalize the score as a percentage of the maximum
-        return score / float(maxscore)
+        # Find which relationships of the first set are in each other set,
+        # and how many relationships of each other set are in the first set
+        present = numpy.zeros((len(otherrelationshiplists), len(columns)), dtype=bool)
+        sizes = numpy.empty(len(otherrelationshiplists), dtype=numpy.intp)
+        sharedcounts = numpy.empty(len(otherrelationshiplists), dtype=numpy.intp)
+        for row, otherrelationships in enumerate(otherrelationshiplists):
+            shared = [columns[otherrelationship] for otherrelationship in otherrelationships if otherrelationship in columns]
+            present[row, shared] = True
+            sizes[row] = len(otherrelationships)
+            sharedcounts[row] = len(shared)
+        matched = present[:, relationshipcolumns]
+        
+        # Lay out everything added to each score in the same order as adding them one at a time:
+        # 1 if the sets are the same size, the weight of each relationship that matched,
+        # and a small bonus for each relationship in the other set that was also in the first set
+        # Adding them up with a running sum (rather than a dot product) keeps the order,
+        # so the scores are exactly the same as adding them one at a time
+        bonus = 0.05
+        bonuses = numpy.arange(sharedcounts.max()) < sharedcounts[:, numpy.newaxis]
+        parts = numpy.zeros((len(otherrelationshiplists), 1 + len(relationships) + bonuses.shape[1]))
+        parts[:, 0] = sizes == len(relationships)
+        parts[:, 1:1 + len(relationships)] = numpy.where(matched, weights, 0.0)
+        parts[:, 1 + len(relationships):] = numpy.where(bonuses, bonus, 0.0)
+        scores = parts.cumsum(axis=1)[:, -1]
+        
+        # The maximum possible score is 1, the weight of every relationship in the first set,
+        # and the small bonus for every relationship in the other set
+        basescore = numpy.concatenate(([1.0], weights)).cumsum()[-1]
+        bonuses = numpy.arange(sizes.max()) < sizes[:, numpy.newaxis]
+        maxparts = numpy.zeros((len(otherrelationshiplists), 1 + bonuses.shape[1]))
+        maxparts[:, 0] = basescore
+        maxparts[:, 1:] = numpy.where(bonuses, bonus, 0.0)
+        maxscores = maxparts.cumsum(axis=1)[:, -1]
+        
+        # Normalize the scores as a percentage of the maximum
+        return (scores / maxscores).tolist()
 
     # Calculate a score for each answer figure choice based on the A->B:C->Choice relationships
     def calculatetransformscore(self, prob):
-        scores = {}
         figures = prob['figures']
         
         # Analyze the relationship between A and B
         targetrelationship = self.findfigurerelationships(figures['A'], figures['B'])
         
+        keys = []
+        relationships = []
         for number in range(6):
             key = str(number + 1)
             
@@ -1374,9 +1498,11 @@ class Agent:
             #print('Figure test %s' % key)
             #print(relationship)
             
-            # Score the similarity between the A -> B relationship and the C -> X relationship
-            scores[key] = self.scorerelationships(targetrelationship, relationship)
+            keys.append(key)
+            relationships.append(relationship)
         
+        # Score the similarity between the A -> B relationship and every C -> X relationship
+        scores = dict(zip(keys, self.scorerelationshipbatch(targetrelationship, relationships)))
         return scores
     
     # Choose the correct answer for the problem
@@ -0,0 +1,174 @@
+# Persistent cache for expensive image analysis results
+# Results are kept in memory and in a small SQLite database, so that new
+# processes (each Project run, each CI build) don't re-analyze images they
+# have already seen
+
+# Import Python library modules
+import os, sqlite3, hashlib, threading, atexit
+from collections import OrderedDict
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# The default database file, in the user's own cache directory rather than the shared temp directory
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'ravens', 'analysis.db')
+
+# Hash the source code of some modules, to tell apart results from different versions of the code
+# Checkouts with the same analysis code can share results, any change to it starts afresh
+def codehash(*modules):
+    digest = hashlib.sha1()
+    for module in modules:
+        path = module.__file__
+        # Hash the source rather than the compiled file, if it's there
+        if path.endswith(('.pyc', '.pyo')) and os.path.isfile(path[:-1]):
+            path = path[:-1]
+        with open(path, 'rb') as sourcefile:
+            digest.update(sourcefile.read())
+    return digest.hexdigest()[:12]
+
+# Keeps analysis results keyed by the analysis name, a content hash and a version tag
+# Both the memory and disk copies are size-bounded, the least recently used
+# entries are thrown away first
+class AnalysisCache(object):
+
+    def __init__(self, path=DEFAULT_PATH, version=1, maxentries=50000, memoryentries=5000):
+        self.path = path
+        self.version = str(version)
+        self.maxentries = maxentries
+        self.memoryentries = memoryentries
+        self.memory = OrderedDict()
+        self.pending = {}
+        self.touched = {}
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pid = None
+        atexit.register(self.flush)
+
+    # Open the database if it isn't already open in this process
+    # Connections can't be shared with forked worker processes, so re-open after a fork
+    def connect(self):
+        if not self.path:
+            return None
+        if self.connection and self.pid == os.getpid():
+            return self.connection
+        if self.pid is not None:
+            # Anything pending was inherited from the parent process, which will write it
+            self.pending = {}
+            self.touched = {}
+        self.pid = os.getpid()
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS analysis (key TEXT PRIMARY KEY, value BLOB, used INTEGER)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS analysisused ON analysis (used)')
+            row = self.connection.execute('SELECT MAX(used) FROM analysis').fetchone()
+            self.clock = max(self.clock, row[0] or 0)
+        except (sqlite3.Error, OSError) as error:
+            # The cache is only an optimization, keep going without the disk copy
+            print('Analysis cache disabled, could not open %s (%s)' % (self.path, error))
+            self.path = None
+            self.connection = None
+        return self.connection
+
+    # Build the full key for one analysis of one piece of content
+    def makekey(self, name, contenthash):
+        return '%s:%s:%s' % (self.version, name, contenthash)
+
+    # Look up a result, returns None if it isn't cached
+    def get(self, name, contenthash):
+        key = self.makekey(name, contenthash)
+        with self.lock:
+            self.clock += 1
+            if key in self.memory:
+                # Move this entry to the most recently used end
+                value = self.memory.pop(key)
+                self.memory[key] = value
+                if self.path:
+                    self.touched[key] = self.clock
+                self.hits += 1
+                return pickle.loads(value)
+            connection = self.connect()
+            row = None
+            if connection:
+                try:
+                    row = connection.execute('SELECT value FROM analysis WHERE key = ?', (key,)).fetchone()
+                except sqlite3.Error:
+                    row = None
+            if row is None:
+                self.misses += 1
+                return None
+            value = bytes(row[0])
+            self.remember(key, value)
+            self.touched[key] = self.clock
+            self.hits += 1
+            return pickle.loads(value)
+
+    # Store a result in memory and queue it to be written to disk
+    def put(self, name, contenthash, result):
+        key = self.makekey(name, contenthash)
+        value = pickle.dumps(result, 2)
+        with self.lock:
+            self.clock += 1
+            self.remember(key, value)
+            if self.path:
+                self.pending[key] = value
+                self.touched[key] = self.clock
+                # Write in batches, committing every result would be slow
+                if len(self.pending) >= 100:
+                    self.write()
+
+    # Keep a result in memory, dropping the least recently used ones past the limit
+    def remember(self, key, value):
+        self.memory.pop(key, None)
+        self.memory[key] = value
+        while len(self.memory) > self.memoryentries:
+            self.memory.popitem(last=False)
+
+    # Write all of the pending results to disk
+    def flush(self):
+        with self.lock:
+            self.write()
+
+    # Write pending results and usage times, then trim the database to size
+    # Must be called with the lock held
+    def write(self):
+        if not self.pending and not self.touched:
+            return
+        connection = self.connect()
+        if not connection:
+            return
+        try:
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO analysis (key, value, used) VALUES (?, ?, ?)',
+                    [(key, sqlite3.Binary(value), self.touched.get(key, self.clock)) for key, value in self.pending.items()])
+                connection.executemany('UPDATE analysis SET used = ? WHERE key = ?',
+                    [(used, key) for key, used in self.touched.items() if not key in self.pending])
+                count = connection.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+                if count > self.maxentries:
+                    # Remove the least recently used entries, with some room to spare
+                    extra = count - int(self.maxentries * 0.9)
+                    connection.execute('DELETE FROM analysis WHERE key IN (SELECT key FROM analysis ORDER BY used LIMIT ?)', (extra,))
+        except sqlite3.Error as error:
+            print('Analysis cache write failed (%s)' % error)
+        self.pending = {}
+        self.touched = {}
+
+    # Forget everything, both in memory and on disk
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.pending = {}
+            self.touched = {}
+            connection = self.connect()
+            if connection:
+                try:
+                    with connection:
+                        connection.execute('DELETE FROM analysis')
+                except sqlite3.Error as error:
+                    print('Analysis cache clear failed (%s)' % error)
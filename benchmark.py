@@ -0,0 +1,268 @@
+# Benchmark the agent over the verbal and visual problem sets
+# Runs the same problems as the Project drivers, a number of times, and reports
+# throughput, per-problem latency, peak memory and accuracy
+# The results can be saved as a baseline, and later runs compared against it
+# Run this module from the directory with the problem folders:
+#   python benchmark.py [--repeat N] [--baseline FILE] [--save-baseline FILE]
+# Use --help for all of the options
+
+# Import Python library modules
+import os, sys, json, argparse
+from timeit import default_timer
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory just won't be reported
+    resource = None
+
+# Import the problem loaders used by the Project drivers
+from ProblemSet import ProblemSet
+from VisualProblemSet import VisualProblemSet
+
+# Import required modules
+import helpers, images, analysiscache, instrumentation
+
+# The folders the Project drivers read problems from
+VERBAL_DIRECTORY = 'Problems'
+VISUAL_DIRECTORY = 'Problems (Image Data)'
+# Change this whenever the results layout changes, older baselines can't be compared
+BASELINE_VERSION = 2
+# How much worse a run can be than the baseline before it counts as a regression
+DEFAULT_TOLERANCE = 0.1
+
+# Swallows everything the agent prints while it's being timed
+class Quiet(object):
+    def write(self, text):
+        pass
+    def flush(self):
+        pass
+
+# Load the problems of every set, the same way the Project drivers do
+# Only sets with one of the given filters in their name are loaded, if there are filters
+# Returns a list of (set name, problem) pairs, in set and problem order
+def loadproblems(verbal=True, visual=True, filters=None):
+    problems = []
+    def wanted(setname):
+        return not filters or any(filter in setname for filter in filters)
+    if verbal and os.path.isdir(VERBAL_DIRECTORY):
+        for setname in sorted(os.listdir(VERBAL_DIRECTORY)):
+            if not wanted(setname):
+                continue
+            problemset = ProblemSet(setname)
+            for problemname in sorted(os.listdir(os.path.join(VERBAL_DIRECTORY, setname))):
+                with open(os.path.join(VERBAL_DIRECTORY, setname, problemname)) as problemfile:
+                    problemset.addProblem(problemfile)
+            problems.extend((setname, problem) for problem in problemset.getProblems())
+    if visual and os.path.isdir(VISUAL_DIRECTORY):
+        for setname in sorted(os.listdir(VISUAL_DIRECTORY)):
+            if not wanted(setname):
+                continue
+            problemset = VisualProblemSet(setname)
+            for problemname in sorted(os.listdir(os.path.join(VISUAL_DIRECTORY, setname))):
+                problemset.addProblem(setname, problemname)
+            problems.extend((setname, problem) for problem in problemset.getProblems())
+    return problems
+
+# Get the peak memory use of this process in bytes, or None if it isn't available
+def peakmemory():
+    if not resource:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, Mac OS bytes
+    if sys.platform != 'darwin':
+        peak *= 1024
+    return peak
+
+# Solve every problem once with a new agent
+# The problems are loaded fresh each time, since solving marks the answers as given
+# Each agent starts from the knowledge base snapshot loadknowledge, if given
+# Problems the agent answers without timing them (like the debugging filters in
+# Agent.solve) are marked as not solved
+# Returns the results of the run
+def runonce(loader, quiet=True, loadknowledge=None):
+    # Import the agent here, so it's loaded after any working directory changes
+    import Agent as agentmodule
+    agentmodule.LOAD_KNOWLEDGE = loadknowledge
+    problems = loader()
+    agent = agentmodule.Agent()
+    run = {'problems':[]}
+    stdout = sys.stdout
+    if quiet:
+        sys.stdout = Quiet()
+    try:
+        runstart = default_timer()
+        for setname, problem in problems:
+            # Every problem the agent really solves gets an instrumentation record
+            recorded = len(instrumentation.timings.problems)
+            start = default_timer()
+            answer = agent.Solve(problem)
+            seconds = default_timer() - start
+            problem.setAnswerReceived(answer)
+            result = {}
+            result['set'] = setname
+            result['name'] = problem.getName()
+            result['type'] = problem.getProblemType()
+            result['answer'] = problem.getGivenAnswer()
+            result['correct'] = problem.getCorrect() == 'Correct'
+            result['seconds'] = seconds
+            result['solved'] = len(instrumentation.timings.problems) > recorded
+            run['problems'].append(result)
+        run['seconds'] = default_timer() - runstart
+    finally:
+        sys.stdout = stdout
+    return run
+
+# Combine the results of every run into one summary
+# Latencies are taken from every solve of every run, throughput from the median run
+# Only solved problems are counted, the skipped ones are just listed by name
+def summarize(runs):
+    summary = {'version':BASELINE_VERSION}
+    # The agent skips the same problems every run, so the last run's are used
+    solved = [index for index, result in enumerate(runs[-1]['problems']) if result['solved']]
+    problemcount = len(solved)
+    summary['problems'] = problemcount
+    summary['skipped'] = [result['name'] for result in runs[-1]['problems'] if not result['solved']]
+    summary['runs'] = len(runs)
+    runtimes = sorted(sum(run['problems'][index]['seconds'] for index in solved) for run in runs)
+    summary['seconds'] = helpers.percentile(runtimes, 0.5)
+    summary['throughput'] = problemcount / summary['seconds'] if summary['seconds'] else 0.0
+    latencies = [run['problems'][index]['seconds'] for run in runs for index in solved]
+    summary['latency'] = helpers.summarizelatencies(latencies) if latencies else {'count':0}
+    # Latencies of each problem type, like the ScoreKeeper reports them
+    typelatencies = {}
+    for run in runs:
+        for index in solved:
+            result = run['problems'][index]
+            typelatencies.setdefault(result['type'], []).append(result['seconds'])
+    summary['types'] = dict((problemtype, helpers.summarizelatencies(seconds)) for problemtype, seconds in typelatencies.items())
+    # Each problem's median latency, and its answer in the last run
+    problems = {}
+    for index in solved:
+        result = runs[-1]['problems'][index]
+        details = {}
+        details['set'] = result['set']
+        details['type'] = result['type']
+        details['answer'] = result['answer']
+        details['correct'] = result['correct']
+        details['seconds'] = helpers.percentile([run['problems'][index]['seconds'] for run in runs], 0.5)
+        problems[result['name']] = details
+    summary['problem'] = problems
+    correct = sum(1 for index in solved if runs[-1]['problems'][index]['correct'])
+    summary['correct'] = correct
+    summary['accuracy'] = correct / float(problemcount) if problemcount else 0.0
+    summary['peakmemory'] = peakmemory()
+    return summary
+
+# Compare a summary against a baseline summary
+# Returns a list of regression messages, which is empty if nothing got worse
+def compare(summary, baseline, tolerance=DEFAULT_TOLERANCE):
+    regressions = []
+    if baseline.get('version') != BASELINE_VERSION:
+        return ['Baseline is version %s, expected version %s' % (baseline.get('version'), BASELINE_VERSION)]
+    if summary['problems'] != baseline['problems']:
+        regressions.append('Solved %s problems, the baseline solved %s' % (summary['problems'], baseline['problems']))
+    if summary['accuracy'] < baseline['accuracy']:
+        regressions.append('Accuracy dropped from %.1f%% to %.1f%%' % (baseline['accuracy'] * 100, summary['accuracy'] * 100))
+    if summary['throughput'] < baseline['throughput'] * (1 - tolerance):
+        regressions.append('Throughput dropped from %.2f to %.2f problems/s' % (baseline['throughput'], summary['throughput']))
+    for name in ('p50', 'p90', 'p99', 'max'):
+        if name in baseline['latency'] and summary['latency'].get(name, 0) > baseline['latency'][name] * (1 + tolerance):
+            regressions.append('%s latency rose from %.1f to %.1f ms' % (name, baseline['latency'][name] * 1000, summary['latency'][name] * 1000))
+    if summary['peakmemory'] and baseline['peakmemory'] and summary['peakmemory'] > baseline['peakmemory'] * (1 + tolerance):
+        regressions.append('Peak memory rose from %.1f to %.1f MB' % (baseline['peakmemory'] / 1048576.0, summary['peakmemory'] / 1048576.0))
+    # Answers that used to be right should stay right
+    for problemname, details in sorted(baseline['problem'].items()):
+        current = summary['problem'].get(problemname)
+        if current and details['correct'] and not current['correct']:
+            regressions.append('%s is now incorrect (answered %s)' % (problemname, current['answer']))
+    return regressions
+
+# Print a readable report of a summary
+def printsummary(summary, slowest=5):
+    print('Solved %s problems %s times' % (summary['problems'], summary['runs']))
+    if summary['skipped']:
+        print('WARNING: the agent skipped %s problems without solving them, they are left out of these results' % len(summary['skipped']))
+    print('Throughput: %.2f problems/s (%.2f s of solving per run)' % (summary['throughput'], summary['seconds']))
+    if summary['latency']['count']:
+        print('Latency: ' + ', '.join('%s %.1f ms' % (name, summary['latency'][name] * 1000) for name, fraction in helpers.PERCENTILES))
+    for problemtype, latency in sorted(summary['types'].items()):
+        print('  %s: %s' % (problemtype, ', '.join('%s %.1f ms' % (name, latency[name] * 1000) for name, fraction in helpers.PERCENTILES)))
+    if summary['peakmemory']:
+        print('Peak memory: %.1f MB' % (summary['peakmemory'] / 1048576.0))
+    print('Accuracy: %s/%s (%.1f%%)' % (summary['correct'], summary['problems'], summary['accuracy'] * 100))
+    # Show the slowest problems, the first place to look when the latency is high
+    slowproblems = sorted(summary['problem'].items(), key=lambda item: item[1]['seconds'], reverse=True)[:slowest]
+    if slowproblems:
+        print('Slowest problems:')
+        for problemname, details in slowproblems:
+            print('  %s: %.1f ms' % (problemname, details['seconds'] * 1000))
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the agent on the Raven's problem sets")
+    parser.add_argument('--root', default='.', help='directory with the problem folders (default: current directory)')
+    parser.add_argument('--verbal-only', action='store_true', help='only run the verbal problems')
+    parser.add_argument('--visual-only', action='store_true', help='only run the visual problems')
+    parser.add_argument('--set', action='append', dest='filters', help='only run sets with this in their name (can be repeated)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs (default: 3)')
+    parser.add_argument('--cold', action='store_true', help='start each run without any cached image analysis')
+    parser.add_argument('--workers', type=int, help='worker processes for image analysis')
+    parser.add_argument('--load-knowledge', help='knowledge base snapshot for each run to start from')
+    parser.add_argument('--output', help='write the full results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this baseline file')
+    parser.add_argument('--save-baseline', help='save the results as a baseline file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='allowed slowdown before flagging a regression (default: 0.1)')
+    parser.add_argument('--verbose', action='store_true', help="show the agent's output")
+    options = parser.parse_args(args)
+
+    # Read the baseline before changing directory, so relative paths work as expected
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as baselinefile:
+            baseline = json.load(baselinefile)
+    output = options.output and os.path.abspath(options.output)
+    savebaseline = options.save_baseline and os.path.abspath(options.save_baseline)
+    loadknowledge = options.load_knowledge and os.path.abspath(options.load_knowledge)
+    # The problem loaders use paths relative to the problem folders
+    os.chdir(options.root)
+    if options.workers:
+        images.WORKERS = options.workers
+    def loader():
+        return loadproblems(not options.visual_only, not options.verbal_only, options.filters)
+    if not loader():
+        print('No problems found in %s' % os.path.abspath('.'))
+        return 1
+
+    runs = []
+    for index in range(options.repeat):
+        if options.cold:
+            # The worker processes keep the cache they started with, so start new ones too
+            images.closepool()
+            images.cache = analysiscache.AnalysisCache(path=None, version=images.CACHE_VERSION)
+        runs.append(runonce(loader, not options.verbose, loadknowledge))
+        print('Run %s: %.2f s' % (index + 1, runs[-1]['seconds']))
+    summary = summarize(runs)
+    printsummary(summary)
+    if not summary['problems']:
+        # Nothing was measured, so there's nothing to save or compare
+        print('The agent skipped every problem, check the debugging filters in Agent.solve')
+        return 1
+
+    if output:
+        with open(output, 'w') as outputfile:
+            json.dump(summary, outputfile, indent=1, sort_keys=True)
+    if savebaseline:
+        with open(savebaseline, 'w') as baselinefile:
+            json.dump(summary, baselinefile, indent=1, sort_keys=True)
+        print('Saved baseline to %s' % savebaseline)
+    if baseline:
+        regressions = compare(summary, baseline, options.tolerance)
+        if regressions:
+            print('REGRESSIONS against the baseline:')
+            for regression in regressions:
+                print('  ' + regression)
+            return 1
+        print('No regressions against the baseline')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# Compact black and white figures for the images pipeline
+# A figure is stored with one bit per pixel, so a whole problem's figures and
+# object masks only take a few hundred KB and are cheap to send to worker processes
+# This module requires Pillow 2.6.1
+
+# Import standard python libraries
+import hashlib
+
+# Import Pillow 2.6.1
+from PIL import Image
+
+# Import NumPy for array-based image processing
+import numpy
+
+# The number of set bits in every possible byte
+BIT_COUNTS = numpy.array([bin(value).count('1') for value in range(256)], dtype=numpy.int64)
+
+# A black and white image, packed eight pixels to a byte
+# Each row is packed separately (like PIL's mode '1'), with the left-most pixel in the
+# highest bit, but set bits are black pixels rather than white ones
+class BinaryFigure(object):
+    __slots__ = ('size', 'bits')
+
+    def __init__(self, size, bits):
+        # The (width, height) of the figure, the same as PIL's size
+        self.size = tuple(size)
+        # An array of (height, ceil(width / 8)) bytes
+        self.bits = bits
+
+    # Create a figure from an array of booleans, True where the pixels are black
+    @classmethod
+    def frommask(cls, mask):
+        height, width = mask.shape
+        return cls((width, height), numpy.packbits(mask, axis=1).reshape(height, (width + 7) / 8))
+
+    # Create a figure from a PIL image, where anything other than pure white is black
+    # Mode '1' images are already packed the same way, so only their bits are flipped
+    @classmethod
+    def fromimage(cls, image):
+        width, height = image.size
+        if image.mode != '1':
+            return cls.frommask(numpy.asarray(image.convert('L')) != 255)
+        rowbytes = (width + 7) / 8
+        bits = numpy.invert(numpy.frombuffer(image.tobytes(), dtype=numpy.uint8).reshape(height, rowbytes))
+        # Clear the padding bits at the end of each row, they were set by the flip
+        if width % 8:
+            bits[:, -1] &= (0xFF << (8 - width % 8)) & 0xFF
+        return cls((width, height), bits)
+
+    # Get the figure as an array of booleans, True where the pixels are black
+    def mask(self):
+        width, height = self.size
+        return numpy.unpackbits(self.bits, axis=1)[:, :width].astype(bool)
+
+    # Get the figure as a PIL image, black object on a white background
+    # Mode '1' images are made straight from the bits, other modes are converted from that
+    def toimage(self, mode='1'):
+        width, height = self.size
+        image = Image.frombytes('1', self.size, numpy.invert(self.bits).tobytes())
+        if mode != '1':
+            image = image.convert(mode)
+        return image
+
+    # Get the figure as an inverted grayscale image, white object on a black background
+    def toinverted(self):
+        return Image.frombytes('1', self.size, self.bits.tobytes()).convert('L')
+
+    # Count the number of black pixels
+    def count(self):
+        return int(BIT_COUNTS[self.bits].sum())
+
+    # Find the bounding box of the black pixels, in PIL's (left, upper, right, lower) layout
+    # Returns None if there are no black pixels, like PIL's getbbox
+    def getbbox(self):
+        width, height = self.size
+        rows = numpy.nonzero(self.bits.any(axis=1))[0]
+        if not len(rows):
+            return None
+        # Combine every row, so the set columns can be found from a single row
+        columns = numpy.nonzero(numpy.unpackbits(numpy.bitwise_or.reduce(self.bits, axis=0))[:width])[0]
+        return (int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1)
+
+    # Crop the figure to a (left, upper, right, lower) box
+    def crop(self, box):
+        left, upper, right, lower = box
+        return BinaryFigure.frommask(self.mask()[upper:lower, left:right])
+
+    # Calculate a hash of the figure's content to use as a cache key
+    def contenthash(self):
+        content = hashlib.md5(str(self.size))
+        content.update(self.bits.tobytes())
+        return content.hexdigest()
+
+    # The number of bytes used by the pixels
+    def nbytes(self):
+        return self.bits.nbytes
+
+    # Only the size and the packed bytes are needed to pickle a figure
+    def __getstate__(self):
+        return (self.size, self.bits.tobytes())
+
+    def __setstate__(self, state):
+        size, content = state
+        width, height = size
+        self.size = tuple(size)
+        # The bytes are used in place rather than copied, figures are never changed
+        self.bits = numpy.frombuffer(content, dtype=numpy.uint8).reshape(height, (width + 7) / 8)
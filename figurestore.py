@@ -0,0 +1,112 @@
+# Preprocessed store of every figure in the "Problems (Image Data)" tree
+# Each figure image is decoded and binarized once, and the packed pixels of all of
+# them are written to one file, which is memory-mapped when solving
+# Run this module to build the store: python figurestore.py [directory] [store]
+# This module requires Pillow 2.6.1
+
+# Import standard python libraries
+import os, sys, struct
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Import Pillow 2.6.1
+from PIL import Image
+
+# Import NumPy for array-based image processing
+import numpy
+
+# Import required modules
+from binaryfigure import BinaryFigure
+
+# The directory of visual problems, the same one the Project drivers read
+DEFAULT_DIRECTORY = 'Problems (Image Data)'
+# The default store file
+DEFAULT_PATH = 'figures.store'
+# Marks the start of a store file, change the version whenever the layout changes
+MAGIC = 'RAVENFIG'
+VERSION = 1
+# The header is the magic marker, the version and the position and length of the index
+HEADER = struct.Struct('<8sIQQ')
+
+# Normalize a figure path, so the same file always gets the same key
+def figurekey(path):
+    return os.path.normpath(path)
+
+# Decode every figure image in a problem directory and write them all to one store file
+# The figures are stored under their paths, the same paths VisualProblemSet gives them
+# Returns the number of figures stored
+def buildstore(directory=DEFAULT_DIRECTORY, path=DEFAULT_PATH):
+    index = {}
+    # Write to a temporary file first, so a half-written store is never used
+    temppath = path + '.tmp'
+    with open(temppath, 'wb') as storefile:
+        storefile.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        for dirname, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() != '.png':
+                    continue
+                figurepath = os.path.join(dirname, filename)
+                figure = BinaryFigure.fromimage(Image.open(figurepath))
+                stats = os.stat(figurepath)
+                # Keep the file's size and time, so changed images can be spotted
+                index[figurekey(figurepath)] = (storefile.tell(), figure.size, stats.st_size, stats.st_mtime)
+                storefile.write(figure.bits.tobytes())
+        # The index goes after all of the pixels
+        indexoffset = storefile.tell()
+        indexdata = pickle.dumps(index, 2)
+        storefile.write(indexdata)
+        storefile.seek(0)
+        storefile.write(HEADER.pack(MAGIC, VERSION, indexoffset, len(indexdata)))
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temppath, path)
+    return len(index)
+
+# Read-only access to a store file built by buildstore
+# The pixels are memory-mapped, so figures are read straight from the file without copying
+class FigureStore(object):
+
+    # Set verify to check that each figure image hasn't changed since the store was built
+    def __init__(self, path=DEFAULT_PATH, verify=True):
+        self.path = path
+        self.verify = verify
+        self.data = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+        magic, version, indexoffset, indexlength = HEADER.unpack(self.data[:HEADER.size].tostring())
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %s figure store' % (path, VERSION))
+        self.index = pickle.loads(self.data[indexoffset:indexoffset + indexlength].tostring())
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, figurepath):
+        return figurekey(figurepath) in self.index
+
+    # Get the BinaryFigure for a figure image path
+    # Returns None if the figure isn't in the store, or the image has changed since
+    def get(self, figurepath):
+        entry = self.index.get(figurekey(figurepath))
+        if not entry:
+            return None
+        offset, size, filesize, filetime = entry
+        if self.verify:
+            try:
+                stats = os.stat(figurepath)
+            except OSError:
+                return None
+            if stats.st_size != filesize or stats.st_mtime != filetime:
+                return None
+        width, height = size
+        rowbytes = (width + 7) / 8
+        bits = self.data[offset:offset + rowbytes * height].reshape(height, rowbytes)
+        return BinaryFigure(size, bits)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    directory = args[0] if args else DEFAULT_DIRECTORY
+    path = args[1] if len(args) > 1 else DEFAULT_PATH
+    count = buildstore(directory, path)
+    print 'Stored %s figures from "%s" in %s (%s bytes)' % (count, directory, path, os.path.getsize(path))
@@ -0,0 +1,318 @@
+# Generate synthetic Raven's problems for scale benchmarks
+# Problems are written in the same text format ProblemSet.addProblem reads, and
+# optionally drawn as PNGs in the same layout VisualProblemSet.addProblem reads
+# The number of objects per figure, attributes per object and the figure image
+# size are all adjustable, so the agent can be run on much bigger problems than
+# the real ones
+# Run this module to write a problem corpus:
+#   python generator.py [--root DIR] [--count N] [--objects N] [--attributes N] ...
+# The corpus can then be run with: python benchmark.py --root DIR
+# Drawing the visual problems requires Pillow 2.6.1
+
+# Import Python library modules
+import os, sys, math, random, argparse
+
+# Import Pillow 2.6.1
+from PIL import Image, ImageDraw
+
+# The folders the Project drivers read problems from
+VERBAL_DIRECTORY = 'Problems'
+VISUAL_DIRECTORY = 'Problems (Image Data)'
+# The problem figure names for each problem type, the answers are always 1 to 6
+FIGURE_NAMES = {'2x1':['A', 'B', 'C'], '2x2':['A', 'B', 'C'], '3x3':['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']}
+ANSWER_NAMES = ['1', '2', '3', '4', '5', '6']
+# The values of each attribute, in order, changing an attribute moves it along the list
+SHAPES = ['circle', 'square', 'triangle', 'plus', 'rectangle', 'right-triangle']
+ATTRIBUTE_VALUES = {}
+ATTRIBUTE_VALUES['shape'] = SHAPES
+ATTRIBUTE_VALUES['size'] = ['very-small', 'small', 'medium', 'large', 'very-large']
+ATTRIBUTE_VALUES['fill'] = ['no', 'yes']
+ATTRIBUTE_VALUES['angle'] = [str(angle) for angle in range(0, 360, 45)]
+# The attributes every object gets first, extra attributes beyond these get made up names
+BASE_ATTRIBUTES = ['shape', 'size', 'fill', 'angle']
+# The number of values made up attributes have
+EXTRA_VALUES = 4
+# The distance from the middle of each shape to its nearest side, as a fraction of its radius
+# Used to keep the outlines of unfilled shapes the same thickness all the way round
+SHAPE_DEPTHS = {'circle':1.0, 'square':0.7, 'triangle':0.5, 'rectangle':0.45, 'right-triangle':0.33, 'plus':0.32}
+# The real visual problems are 184 pixels square
+DEFAULT_FIGURE_SIZE = 184
+
+# Get the list of attribute names for objects with the given number of attributes
+# Objects always have a shape, the rest are size, fill, angle, then made up ones
+def attributenames(count):
+    names = BASE_ATTRIBUTES[:max(count, 1)]
+    for index in range(count - len(BASE_ATTRIBUTES)):
+        names.append('extra-%s' % (index + 1))
+    return names
+
+# Get the possible values of an attribute
+def attributevalues(attribute):
+    if attribute in ATTRIBUTE_VALUES:
+        return ATTRIBUTE_VALUES[attribute]
+    return ['value-%s' % (index + 1) for index in range(EXTRA_VALUES)]
+
+# Change an attribute value by a number of steps, wrapping around at the end of the values
+def stepvalue(attribute, value, steps):
+    values = attributevalues(attribute)
+    return values[(values.index(value) + steps) % len(values)]
+
+# Make the base figure of a problem, a list of objects with random attribute values
+# Each object is a dict of attribute values, along with its name
+def randomfigure(rng, objectcount, attributes):
+    objects = []
+    for index in range(objectcount):
+        object = {'name':'O%s' % (index + 1)}
+        for attribute in attributes:
+            object[attribute] = rng.choice(attributevalues(attribute))
+        objects.append(object)
+    return objects
+
+# Apply a transformation to a figure, returning a new figure
+# A transformation is a dict of the number of steps to change each attribute by
+def transform(objects, transformation, times=1):
+    newobjects = []
+    for object in objects:
+        newobject = dict(object)
+        for attribute, steps in transformation.items():
+            newobject[attribute] = stepvalue(attribute, object[attribute], steps * times)
+        newobjects.append(newobject)
+    return newobjects
+
+# Make a random transformation that changes one or two of the attributes
+# Attributes in avoid aren't changed, so two transformations can be independent
+def randomtransformation(rng, attributes, avoid=()):
+    choices = [attribute for attribute in attributes if not attribute in avoid]
+    if not choices:
+        return {}
+    transformation = {}
+    for attribute in rng.sample(choices, min(len(choices), rng.randint(1, 2))):
+        transformation[attribute] = rng.randint(1, len(attributevalues(attribute)) - 1)
+    return transformation
+
+# Get a figure as something that can be compared to other figures
+def figurekey(objects):
+    return tuple(tuple(sorted(object.items())) for object in objects)
+
+# Make five wrong answers that are each a small change away from the right answer
+def distractors(rng, answer, attributes):
+    wrong = []
+    seen = set([figurekey(answer)])
+    while len(wrong) < len(ANSWER_NAMES) - 1:
+        objects = [dict(object) for object in answer]
+        # Change one attribute of one or more objects
+        for dummy in range(rng.randint(1, 2)):
+            object = rng.choice(objects)
+            attribute = rng.choice(attributes)
+            object[attribute] = stepvalue(attribute, object[attribute], rng.randint(1, len(attributevalues(attribute)) - 1))
+        # Sometimes leave out an object as well
+        if len(objects) > 1 and rng.random() < 0.2:
+            objects.pop(rng.randrange(len(objects)))
+        key = figurekey(objects)
+        if not key in seen:
+            seen.add(key)
+            wrong.append(objects)
+    return wrong
+
+# Generate one problem of the given type
+# Returns the problem as a dict with its name, type, correct answer and figures,
+# where each figure is a list of objects
+def generateproblem(rng, name, problemtype, objectcount, attributecount):
+    attributes = attributenames(attributecount)
+    base = randomfigure(rng, objectcount, attributes)
+    figures = {}
+    # The first transformation goes across the rows, the second goes down the columns
+    across = randomtransformation(rng, attributes)
+    down = randomtransformation(rng, attributes, across)
+    if problemtype == '2x1':
+        figures['A'] = base
+        figures['B'] = transform(base, across)
+        figures['C'] = randomfigure(rng, objectcount, attributes)
+        answer = transform(figures['C'], across)
+    elif problemtype == '2x2':
+        figures['A'] = base
+        figures['B'] = transform(base, across)
+        figures['C'] = transform(base, down)
+        answer = transform(figures['B'], down)
+    else:
+        for row in range(3):
+            for column in range(3):
+                figures['ABCDEFGHI'[row * 3 + column]] = transform(transform(base, across, column), down, row)
+        answer = figures.pop('I')
+    # Put the right answer in a random place among the wrong ones
+    choices = distractors(rng, answer, attributes)
+    correct = rng.randrange(len(ANSWER_NAMES))
+    choices.insert(correct, answer)
+    for answername, choice in zip(ANSWER_NAMES, choices):
+        figures[answername] = choice
+    problem = {}
+    problem['name'] = name
+    problem['type'] = problemtype
+    problem['correct'] = ANSWER_NAMES[correct]
+    problem['figures'] = figures
+    return problem
+
+# Find where each object goes in a figure, laid out on a grid in object order
+# Returns the (column, row) of each object and the number of columns and rows
+def gridlayout(objects):
+    columns = max(int(math.ceil(math.sqrt(len(objects)))), 1)
+    rows = max(int(math.ceil(len(objects) / float(columns))), 1)
+    positions = [(index % columns, index / columns) for index in range(len(objects))]
+    return positions, columns, rows
+
+# Find the position attributes of each object in a figure from the grid layout
+# An object is above the objects in lower rows, and left of those in columns further right
+def relationships(objects):
+    positions, columns, rows = gridlayout(objects)
+    related = []
+    for object, (column, row) in zip(objects, positions):
+        relations = {}
+        above = [other['name'] for other, (othercolumn, otherrow) in zip(objects, positions) if otherrow > row]
+        leftof = [other['name'] for other, (othercolumn, otherrow) in zip(objects, positions) if othercolumn > column]
+        if above:
+            relations['above'] = above
+        if leftof:
+            relations['left-of'] = leftof
+        related.append(relations)
+    return related
+
+# Write a problem in the text format read by ProblemSet.addProblem
+def writeverbal(problem, path):
+    lines = [problem['name'], problem['type'], problem['correct']]
+    for figurename in FIGURE_NAMES[problem['type']] + ANSWER_NAMES:
+        objects = problem['figures'][figurename]
+        lines.append(figurename)
+        for object, relations in zip(objects, relationships(objects)):
+            lines.append('\t' + object['name'])
+            for attribute in sorted(key for key in object if key != 'name'):
+                lines.append('\t\t%s:%s' % (attribute, object[attribute]))
+            for relation, names in sorted(relations.items()):
+                lines.append('\t\t%s:%s' % (relation, ','.join(names)))
+    with open(path, 'w') as problemfile:
+        problemfile.write('\n'.join(lines) + '\n')
+
+# Get the corners of a regular polygon
+def polygon(centerx, centery, radius, sides, angle):
+    points = []
+    for index in range(sides):
+        radians = math.radians(angle + 360.0 * index / sides)
+        points.append((centerx + radius * math.cos(radians), centery + radius * math.sin(radians)))
+    return points
+
+# Get the corners of a shape, rotated by an angle, or None for a circle
+# Every shape fits inside the circle of the given radius, so shapes in neighboring
+# grid cells never touch
+def shapepoints(shape, centerx, centery, radius, angle):
+    def rotated(points):
+        radians = math.radians(angle)
+        return [(centerx + x * math.cos(radians) - y * math.sin(radians), centery + x * math.sin(radians) + y * math.cos(radians)) for x, y in points]
+    if shape == 'square':
+        return polygon(centerx, centery, radius, 4, angle + 45)
+    if shape == 'triangle':
+        return polygon(centerx, centery, radius, 3, angle - 90)
+    if shape == 'rectangle':
+        width, height = radius * 0.9, radius * 0.45
+        return rotated([(-width, -height), (width, -height), (width, height), (-width, height)])
+    if shape == 'right-triangle':
+        side = radius * 0.7
+        return rotated([(-side, -side), (side, side), (-side, side)])
+    if shape == 'plus':
+        radius *= 0.95
+        arm = radius / 3.0
+        return rotated([(-arm, -radius), (arm, -radius), (arm, -arm), (radius, -arm), (radius, arm), (arm, arm), (arm, radius), (-arm, radius), (-arm, arm), (-radius, arm), (-radius, -arm), (-arm, -arm)])
+    return None
+
+# Draw a shape, filled with the given color
+# The shape can be shrunk towards its middle, by a fraction of its size
+def drawshape(draw, shape, centerx, centery, radius, angle, color, shrink=0.0):
+    points = shapepoints(shape, centerx, centery, radius, angle)
+    if points is None:
+        radius *= 1 - shrink
+        draw.ellipse((centerx - radius, centery - radius, centerx + radius, centery + radius), fill=color)
+        return
+    if shrink:
+        middlex = sum(x for x, y in points) / len(points)
+        middley = sum(y for x, y in points) / len(points)
+        points = [(middlex + (x - middlex) * (1 - shrink), middley + (y - middley) * (1 - shrink)) for x, y in points]
+    draw.polygon(points, fill=color)
+
+# Draw a figure as a black and white image, objects laid out on a grid
+# Only shape, size, fill and angle can be drawn, any other attributes are left out
+def drawfigure(objects, figuresize):
+    image = Image.new('L', (figuresize, figuresize), 255)
+    draw = ImageDraw.Draw(image)
+    positions, columns, rows = gridlayout(objects)
+    cellsize = figuresize / float(max(columns, rows))
+    sizes = ATTRIBUTE_VALUES['size']
+    for object, (column, row) in zip(objects, positions):
+        centerx = (column + 0.5) * cellsize
+        centery = (row + 0.5) * cellsize
+        # Sizes go from a fifth to almost half of the cell
+        scale = sizes.index(object.get('size', 'medium'))
+        radius = cellsize * (0.2 + 0.06 * scale)
+        angle = int(object.get('angle', '0'))
+        shape = object['shape']
+        # Draw unfilled shapes as a solid shape with the inside cut out
+        # The outlines need to be a few pixels thick, or they break up when rotated
+        drawshape(draw, shape, centerx, centery, radius, angle, 0)
+        if object.get('fill', 'no') != 'yes':
+            outline = max(2.0, cellsize / 30.0)
+            drawshape(draw, shape, centerx, centery, radius, angle, 255, min(outline / (radius * SHAPE_DEPTHS[shape]), 0.6))
+    return image
+
+# Write a problem in the layout read by VisualProblemSet.addProblem
+# The directory gets the problem's text file and a PNG for each figure
+def writevisual(problem, directory, figuresize=DEFAULT_FIGURE_SIZE):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(os.path.join(directory, problem['name'] + '.txt'), 'w') as problemfile:
+        problemfile.write('%s\n%s (Image)\n%s\n' % (problem['name'], problem['type'], problem['correct']))
+    for figurename in FIGURE_NAMES[problem['type']] + ANSWER_NAMES:
+        drawfigure(problem['figures'][figurename], figuresize).save(os.path.join(directory, figurename + '.png'))
+
+# Generate a set of problems and write them under a root directory
+# Verbal problems go in root/Problems/setname and visual ones in
+# root/Problems (Image Data)/setname, so the Project drivers and benchmark can read them
+# Returns the list of generated problems
+def generate(root='.', setname='Synthetic Problems', count=10, types=('2x1', '2x2', '3x3'), objects=3, attributes=4, figuresize=DEFAULT_FIGURE_SIZE, verbal=True, visual=True, seed=1, prefix='Synthetic'):
+    rng = random.Random(seed)
+    problems = []
+    verbaldirectory = os.path.join(root, VERBAL_DIRECTORY, setname)
+    visualdirectory = os.path.join(root, VISUAL_DIRECTORY, setname)
+    if verbal and not os.path.isdir(verbaldirectory):
+        os.makedirs(verbaldirectory)
+    for index in range(count):
+        problemtype = types[index % len(types)]
+        name = '%s %s Problem %02d' % (problemtype, prefix, index + 1)
+        problem = generateproblem(rng, name, problemtype, objects, attributes)
+        if verbal:
+            writeverbal(problem, os.path.join(verbaldirectory, name + '.txt'))
+        if visual:
+            writevisual(problem, os.path.join(visualdirectory, name), figuresize)
+        problems.append(problem)
+    return problems
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic Raven's problems")
+    parser.add_argument('--root', default='.', help='directory to write the problem folders to (default: current directory)')
+    parser.add_argument('--set', default='Synthetic Problems', help='name of the problem set folder')
+    parser.add_argument('--count', type=int, default=10, help='number of problems (default: 10)')
+    parser.add_argument('--types', default='2x1,2x2,3x3', help='comma separated problem types to cycle through (default: 2x1,2x2,3x3)')
+    parser.add_argument('--objects', type=int, default=3, help='objects per figure (default: 3)')
+    parser.add_argument('--attributes', type=int, default=4, help='attributes per object, not counting position (default: 4)')
+    parser.add_argument('--figure-size', type=int, default=DEFAULT_FIGURE_SIZE, help='width and height of the figure images (default: 184)')
+    parser.add_argument('--verbal-only', action='store_true', help='only write the verbal problems')
+    parser.add_argument('--visual-only', action='store_true', help='only write the visual problems')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default: 1)')
+    parser.add_argument('--prefix', default='Synthetic', help='word used in the problem names (default: Synthetic)')
+    options = parser.parse_args(args)
+    types = [problemtype.strip() for problemtype in options.types.split(',')]
+    for problemtype in types:
+        if not problemtype in FIGURE_NAMES:
+            parser.error('unknown problem type %s' % problemtype)
+    problems = generate(options.root, options.set, options.count, types, options.objects, options.attributes, options.figure_size, not options.visual_only, not options.verbal_only, options.seed, options.prefix)
+    print('Wrote %s problems to %s' % (len(problems), os.path.abspath(options.root)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
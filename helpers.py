@@ -2,7 +2,10 @@
 # Avoids cluttering up the main Agent module
 
 # Import Python library modules
-import random
+import random, math, datetime
+
+# The latency percentiles reported for each problem type
+PERCENTILES = [('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)]
 
 # Just for keeping track of scores between problems
 # The agent isn't considered correct unless it ranks
@@ -13,6 +16,8 @@ class ScoreKeeper(object):
         self.problems = {}
         self.count = 0
         self.times = {}
+        self.types = {}
+        self.stagetimes = {}
     
     # Add an individual score for one choice in one problem    
     def addscore(self, problemname, scorename, choicename, score):
@@ -33,8 +38,15 @@ class ScoreKeeper(object):
         self.calculateranks(problemname)
         self.count += 1
         
-    def addtime(self, problemname, problemtime):
+    # Add the time taken to answer a problem, in seconds (a timedelta also works)
+    # problemtype is the kind of problem for grouping latencies, for example '2x1 image',
+    # and stages the seconds spent in each stage of solving it
+    def addtime(self, problemname, problemtime, problemtype=None, stages=None):
+        if isinstance(problemtime, datetime.timedelta):
+            problemtime = problemtime.total_seconds()
         self.times[problemname] = problemtime
+        self.types[problemname] = problemtype or 'unknown'
+        self.stagetimes[problemname] = dict(stages or {})
         
     # Calculate the score rank of each choice in a problem
     def calculateranks(self, problemname):
@@ -64,11 +76,39 @@ class ScoreKeeper(object):
     def calculatetimes(self):
         totalmilliseconds = 0
         for calctime in list(self.times.values()):
-            totalmilliseconds += calctime.microseconds / 1000.0
+            totalmilliseconds += calctime * 1000.0
         averagemilliseconds = 0
         if self.times:
             averagemilliseconds = totalmilliseconds / float(len(self.times))
         return 'Calculated %s answers in %s milliseconds (%s ms per problem)' % (len(self.times), totalmilliseconds, averagemilliseconds)
+        
+    # Calculate the latency percentiles of each problem type, overall and for each stage
+    # Returns {problemtype: {'count':n, 'p50':seconds, ..., 'stages':{stage: {...}}}}
+    def calculatelatencies(self):
+        typetimes = {}
+        typestages = {}
+        for problemname, calctime in list(self.times.items()):
+            problemtype = self.types[problemname]
+            typetimes.setdefault(problemtype, []).append(calctime)
+            stages = typestages.setdefault(problemtype, {})
+            for stage, seconds in list(self.stagetimes[problemname].items()):
+                stages.setdefault(stage, []).append(seconds)
+        latencies = {}
+        for problemtype, calctimes in list(typetimes.items()):
+            latencies[problemtype] = summarizelatencies(calctimes)
+            latencies[problemtype]['stages'] = dict((stage, summarizelatencies(stagetimes)) for stage, stagetimes in list(typestages[problemtype].items()))
+        return latencies
+        
+    # Describe the latencies of each problem type in milliseconds, one line per type
+    # Pass in latencies already calculated to not calculate them again
+    def latencyreport(self, latencies=None):
+        if latencies is None:
+            latencies = self.calculatelatencies()
+        lines = []
+        for problemtype, latency in list(sorted(latencies.items())):
+            values = ', '.join('%s %.1f ms' % (name, latency[name] * 1000.0) for name, fraction in PERCENTILES)
+            lines.append('%s: %s problems, %s' % (problemtype, latency['count'], values))
+        return '\n'.join(lines)
     
     # Save the scores to a file
     def save(self):
@@ -78,6 +118,84 @@ class ScoreKeeper(object):
         print(self.calculatetotals())
         print(self.calculatetimes())
         
+# Find a percentile of a list of values, using the nearest rank
+# fraction is between 0 and 1, 1 gives the largest value
+def percentile(values, fraction):
+    ordered = sorted(values)
+    rank = int(math.ceil(fraction * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+    
+# Summarize a list of latencies with the count and each of the PERCENTILES
+def summarizelatencies(latencies):
+    summary = {'count':len(latencies)}
+    for name, fraction in PERCENTILES:
+        summary[name] = percentile(latencies, fraction)
+    return summary
+        
+# Find the assignment of rows to columns with the highest total weight (the Hungarian algorithm)
+# weights is a list of rows, each a list of the weights of pairing that row with each column
+# Every row gets a different column, or every column a different row if there are more rows
+# Use integer weights to get exact results
+# Returns a list of (row, column) pairs, in row order
+def bestassignment(weights):
+    rowcount = len(weights)
+    columncount = len(weights[0]) if weights else 0
+    if not rowcount or not columncount:
+        return []
+    # Make the matrix square with zero weight rows or columns, and turn it into costs to minimize
+    size = max(rowcount, columncount)
+    costs = [[-weights[row][column] if row < rowcount and column < columncount else 0 for column in range(size)] for row in range(size)]
+    infinity = float('inf')
+    # Potentials of each row and column, and the row assigned to each column
+    # Index 0 is a placeholder column (and row) used while adding each row
+    rowpotentials = [0] * (size + 1)
+    columnpotentials = [0] * (size + 1)
+    columnrows = [0] * (size + 1)
+    previous = [0] * (size + 1)
+    for row in range(1, size + 1):
+        # Add this row, following the cheapest path of reassignments to a free column
+        columnrows[0] = row
+        column = 0
+        mincosts = [infinity] * (size + 1)
+        used = [False] * (size + 1)
+        while True:
+            used[column] = True
+            currentrow = columnrows[column]
+            delta = infinity
+            nextcolumn = None
+            for othercolumn in range(1, size + 1):
+                if used[othercolumn]:
+                    continue
+                cost = costs[currentrow - 1][othercolumn - 1] - rowpotentials[currentrow] - columnpotentials[othercolumn]
+                if cost < mincosts[othercolumn]:
+                    mincosts[othercolumn] = cost
+                    previous[othercolumn] = column
+                if mincosts[othercolumn] < delta:
+                    delta = mincosts[othercolumn]
+                    nextcolumn = othercolumn
+            for othercolumn in range(size + 1):
+                if used[othercolumn]:
+                    rowpotentials[columnrows[othercolumn]] += delta
+                    columnpotentials[othercolumn] -= delta
+                else:
+                    mincosts[othercolumn] -= delta
+            column = nextcolumn
+            if columnrows[column] == 0:
+                # Found a free column
+                break
+        # Shift the assignments back along the path
+        while column:
+            previouscolumn = previous[column]
+            columnrows[column] = columnrows[previouscolumn]
+            column = previouscolumn
+    # Leave out the padding
+    pairs = []
+    for column in range(1, size + 1):
+        row = columnrows[column] - 1
+        if row < rowcount and column - 1 < columncount:
+            pairs.append((row, column - 1))
+    return sorted(pairs)
+        
 # Give every object a random label
 # This is only used for debugging purposes
 def randomizelabels(prob, remapper):
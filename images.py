@@ -3,24 +3,75 @@
 # This module requires Pillow 2.6.1
 
 # Import standard python libraries
-import sys, operator, hashlib
+import os, sys, operator, hashlib, multiprocessing, threading, bisect
 from uuid import uuid4
 
 # Import Pillow 2.6.1
 from PIL import Image, ImageOps, ImageChops, ImageDraw, ImageFont
 
+# Import NumPy for array-based image processing
+import numpy
+
+# Import required modules
+import analysiscache, figurestore, instrumentation, rotation, binaryfigure
+from binaryfigure import BinaryFigure
+
 DISTINCT_COLORS = [(0x00, 0xFF, 0x00), (0x00, 0x00, 0xFF), (0xFF, 0x00, 0x00), (0x01, 0xFF, 0xFE), (0xFF, 0xA6, 0xFE), (0xFF, 0xDB, 0x66), (0x00, 0x64, 0x01), (0x01, 0x00, 0x67), (0x95, 0x00, 0x3A), (0x00, 0x7D, 0xB5), (0xFF, 0x00, 0xF6), (0xFF, 0xEE, 0xE8), (0x77, 0x4D, 0x00), (0x90, 0xFB, 0x92), (0x00, 0x76, 0xFF), (0xD5, 0xFF, 0x00), (0xFF, 0x93, 0x7E), (0x6A, 0x82, 0x6C), (0xFF, 0x02, 0x9D), (0xFE, 0x89, 0x00), (0x7A, 0x47, 0x82), (0x7E, 0x2D, 0xD2), (0x85, 0xA9, 0x00), (0xFF, 0x00, 0x56), (0xA4, 0x24, 0x00), (0x00, 0xAE, 0x7E), (0x68, 0x3D, 0x3B), (0xBD, 0xC6, 0xFF), (0x26, 0x34, 0x00), (0xBD, 0xD3, 0x93), (0x00, 0xB9, 0x17), (0x9E, 0x00, 0x8E), (0x00, 0x15, 0x44), (0xC2, 0x8C, 0x9F), (0xFF, 0x74, 0xA3), (0x01, 0xD0, 0xFF), (0x00, 0x47, 0x54), (0xE5, 0x6F, 0xFE), (0x78, 0x82, 0x31), (0x0E, 0x4C, 0xA1), (0x91, 0xD0, 0xCB), (0xBE, 0x99, 0x70), (0x96, 0x8A, 0xE8), (0xBB, 0x88, 0x00), (0x43, 0x00, 0x2C), (0xDE, 0xFF, 0x74), (0x00, 0xFF, 0xC6), (0xFF, 0xE5, 0x02), (0x62, 0x0E, 0x00), (0x00, 0x8F, 0x9C), (0x98, 0xFF, 0x52), (0x75, 0x44, 0xB1), (0xB5, 0x00, 0xFF), (0x00, 0xFF, 0x78), (0xFF, 0x6E, 0x41), (0x00, 0x5F, 0x39), (0x6B, 0x68, 0x82), (0x5F, 0xAD, 0x4E), (0xA7, 0x57, 0x40), (0xA5, 0xFF, 0xD2), (0xFF, 0xB1, 0x67), (0x00, 0x9B, 0xFF), (0xE8, 0x5E, 0xBE)]
 
-hashdb = {}
+# Change this whenever the analysis code changes, so old cached results are ignored
+ANALYSIS_VERSION = 2
+
+# Analysis results are expensive to calculate, remember them between runs
+# The version includes a hash of the analysis code, so results from other code are never used
+CACHE_VERSION = '%s-%s' % (ANALYSIS_VERSION, analysiscache.codehash(sys.modules[__name__], rotation, binaryfigure))
+cache = analysiscache.AnalysisCache(version=CACHE_VERSION)
+
+# The number of worker processes analyze uses by default, 1 analyzes figures in this process
+WORKERS = 1
+# The pool of worker processes, created the first time figures are analyzed in parallel
+pool = None
+poolworkers = 0
 
+# The preprocessed figure store (built by running figurestore.py), if it exists
+# Figures found in the store are read from it instead of decoding their images
+# Set to None to always decode the figure images
+FIGURE_STORE = figurestore.DEFAULT_PATH
+# The opened figure store, False if there isn't one
+store = None
+
+# Set to render debug composites (problem.png, detected.png and analyzed.png) for every problem
+# Rendering is slow, so it is off by default and happens in the background when on
+DEBUG_RENDER = False
+# The directory the debug composites are written to
+DEBUG_DIRECTORY = '.'
+# Debug renders that are still running
+renders = []
+renderlock = threading.Lock()
+# Fonts used for labels, loaded the first time each size is needed
+fonts = {}
+
+# Get a black and white figure for an image, converting PIL images if needed
+def asbinary(image):
+    if isinstance(image, BinaryFigure):
+        return image
+    return BinaryFigure.fromimage(image)
+    
+# Load the label font at the given size
+def loadfont(size):
+    if not size in fonts:
+        fonts[size] = ImageFont.truetype("calibri.ttf", size)
+    return fonts[size]
+    
 def pasteoutline(image, paste, location, linesize=3, label=None):
+    if isinstance(paste, BinaryFigure):
+        paste = paste.toimage()
     width, height = paste.size
     outline = (location[0] - linesize, location[1] - linesize, location[0] + width + linesize, location[1] + height + linesize)
     image.paste((0,0,0), outline)
     image.paste(paste, location)
     if label:
         draw = ImageDraw.Draw(image)
-        font = ImageFont.truetype("calibri.ttf", 36)
+        font = loadfont(36)
         draw.text((location[0], location[1]-35), label, (0,0,0), font=font)
         
 def printproblem(figures):
@@ -36,7 +87,7 @@ def printproblem(figures):
     lastproblem = sorted(problems.keys())[-1]
     question = chr(ord(lastproblem) + 1)
     questimage = image = Image.new('RGB', size, 'white')
-    font = ImageFont.truetype("calibri.ttf", 160)
+    font = loadfont(160)
     draw = ImageDraw.Draw(image)
     draw.text((50, 20), '?', (0,0,0), font=font)
     problems[question] = {'name':question, 'image':questimage}
@@ -56,23 +107,23 @@ def printproblem(figures):
         pasteoutline(image, problems[problem]['image'], top, label=problem)
     return image
     
-def printfigures(figures):
+def printfigures(figures, directory='.'):
     print '** TESTING **'
     image = printproblem(figures)
-    image.save('problem.png')
+    image.save(os.path.join(directory, 'problem.png'))
     colored = {}
-    colors = DISTINCT_COLORS
+    # Use a copy of the colors, so that they aren't used up across problems
+    colors = list(DISTINCT_COLORS)
     for name, figure in figures.items():
         colored[name] = dict(figure)
         oldimage = colored[name]['image']
-        newimage = blackandwhite(oldimage)
-        newimage, usedcolors = colorize(newimage, colors)
+        newimage, usedcolors = colorize(oldimage, colors)
         print len(usedcolors)
         for usedcolor in usedcolors:
             colors.remove(usedcolor)
         colored[name]['image'] = newimage
     image = printproblem(colored)
-    image.save('detected.png')
+    image.save(os.path.join(directory, 'detected.png'))
     metrics = ['outsideness', 'darkness', 'connectedness']
     maxes = {}
     mins = {}
@@ -121,7 +172,7 @@ def printfigures(figures):
             #rgb[0] = 0
             #rgb[2] = 0
             newcolor = tuple(rgb)
-            newcolored, dummy = colorize(split, [newcolor, (0,0,0)])
+            newcolored, dummy = colorize(splitimage(split), [newcolor, (0,0,0)])
             recolored.append(newcolored)
         combined = None
         for recolor in recolored:
@@ -131,12 +182,38 @@ def printfigures(figures):
                 combined = ImageChops.multiply(combined, recolor)
         splitted[name]['image'] = combined
     image = printproblem(splitted)
-    image.save('analyzed.png')
+    image.save(os.path.join(directory, 'analyzed.png'))
     print '** DONE **'
     #exit()
+    
+# Render the debug composites for a problem's figures in the background
+# Only one render runs at a time, since each one writes the same files
+def renderfigures(figures, directory=None):
+    if directory is None:
+        directory = DEBUG_DIRECTORY
+    # Copy just what the render needs, analyze keeps changing the figures
+    figures = dict((name, {'name':figure['name'], 'image':figure['image']}) for name, figure in figures.items())
+    def render():
+        # The analysis done for the render would otherwise be timed as part of
+        # whichever problem is being solved by then
+        with renderlock, instrumentation.disabled():
+            printfigures(figures, directory)
+    thread = threading.Thread(target=render, name='debug-render')
+    thread.start()
+    renders[:] = [running for running in renders if running.is_alive()] + [thread]
+    return thread
+    
+# Wait for all of the background debug renders to finish
+def waitforrenders():
+    for thread in list(renders):
+        thread.join()
+    renders[:] = []
 
 # Crop an image to remove unneeded white space
 def crop(image):
+    if isinstance(image, BinaryFigure):
+        box = image.getbbox()
+        return image.crop(box), box
     # Invert the image so the bounding box calculation works
     inverted = ImageOps.invert(image.convert('L'))
     # Found a bounding box for the non-white parts of the image
@@ -145,6 +222,7 @@ def crop(image):
     return image.crop(box), box
 
 # Convert an image to pure black and white (not grayscale)
+# Returns a packed BinaryFigure, which is what the rest of this module works with
 def blackandwhite(image):
     # Convert to grayscale first
     grayscale = image.convert('L')
@@ -155,140 +233,204 @@ def blackandwhite(image):
             return 0 # All other pixels turn to pure black
     # Apply the filter
     blackwhite = grayscale.point(filter, '1')
-    #Return the filtered image
-    return blackwhite
+    #Return the filtered image, packed without unpacking the pixels
+    return BinaryFigure.fromimage(blackwhite)
     
+# Get the pixels of an image or figure as a 2D array, indexed [y, x]
+# Figures give booleans (True for black), images give their pixel values
+def pixelarray(image):
+    if isinstance(image, BinaryFigure):
+        return image.mask()
+    return numpy.asarray(image)
+
+# Walk through an image one row at a time
+# Yields the y position and the row's pixels as an array (a view, not a copy)
+def walkrows(image):
+    pixels = pixelarray(image)
+    for y in xrange(pixels.shape[0]):
+        yield (y, pixels[y])
+
+# Walk through an image one column at a time
+# Yields the x position and the column's pixels as an array (a view, not a copy)
+def walkcolumns(image):
+    pixels = pixelarray(image)
+    for x in xrange(pixels.shape[1]):
+        yield (x, pixels[:, x])
+
 # Walk through an image pixel by pixel
 def walk(image):
-    width, height = image.size
-    # Go through each pixel sequentially
-    for index, pixel in enumerate(image.getdata()):
-        # Calculate the current position
-        x = index % width
-        y = index / width
-        # Yield the current position and value
-        yield (x,y,pixel)
+    # Go through each row, then each pixel in the row
+    for y, row in walkrows(image):
+        for x, pixel in enumerate(row.tolist()):
+            # Yield the current position and value
+            yield (x,y,pixel)
+
+# Label the distinct objects (4-connected sections of black pixels) in a black and white image
+# Returns an array of labels the same size as the image (0 is white, 1 and up are objects)
+# and a list of stats for each object, ordered by each object's first black pixel
+def labelobjects(blackandwhiteimage):
+    # Find all of the black pixels
+    dark = asbinary(blackandwhiteimage).mask()
+    height, width = dark.shape
+    labels = numpy.zeros((height, width), dtype=numpy.int32)
+    if not dark.any():
+        # No black pixels, there are no objects
+        return labels, []
+        
+    # Find the runs of black pixels in each row
+    padded = numpy.zeros((height, width + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = dark
+    edges = numpy.diff(padded, axis=1)
+    runrows, runstarts = numpy.nonzero(edges == 1)
+    runends = numpy.nonzero(edges == -1)[1]
+    # Find where each row's runs begin in the run list
+    rowbounds = numpy.searchsorted(runrows, numpy.arange(height + 1)).tolist()
+    starts, ends = runstarts.tolist(), runends.tolist()
+    
+    # Join runs that touch a run in the previous row (union-find)
+    parents = list(range(len(starts)))
+    def find(run):
+        while parents[run] != run:
+            parents[run] = parents[parents[run]]
+            run = parents[run]
+        return run
+    for y in range(1, height):
+        above, aboveend = rowbounds[y-1], rowbounds[y]
+        below, belowend = rowbounds[y], rowbounds[y+1]
+        # Walk through both rows of runs from left to right
+        while above < aboveend and below < belowend:
+            if starts[above] < ends[below] and starts[below] < ends[above]:
+                # The runs share a column, so they are the same object
+                aboveroot, belowroot = find(above), find(below)
+                if aboveroot != belowroot:
+                    parents[max(aboveroot, belowroot)] = min(aboveroot, belowroot)
+            if ends[above] < ends[below]:
+                above += 1
+            else:
+                below += 1
+                
+    # Number the objects in the order their first run appears
+    # Runs are in pixel order, so this matches a top-to-bottom, left-to-right scan
+    objectlabels = {}
+    runlabels = []
+    for run in range(len(starts)):
+        root = find(run)
+        if not root in objectlabels:
+            objectlabels[root] = len(objectlabels) + 1
+        runlabels.append(objectlabels[root])
+    runlabels = numpy.array(runlabels, dtype=numpy.int32)
+    
+    # Fill in the label array one run at a time
+    lengths = runends - runstarts
+    offsets = numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+    positions = numpy.repeat(runrows * width + runstarts, lengths) + offsets
+    labels.flat[positions] = numpy.repeat(runlabels, lengths)
+    
+    # Calculate the stats for each object from its runs
+    count = len(objectlabels)
+    areas = numpy.bincount(runlabels, weights=lengths, minlength=count + 1)
+    lefts = numpy.full(count + 1, width, dtype=numpy.int64)
+    uppers = numpy.full(count + 1, height, dtype=numpy.int64)
+    rights = numpy.zeros(count + 1, dtype=numpy.int64)
+    lowers = numpy.zeros(count + 1, dtype=numpy.int64)
+    numpy.minimum.at(lefts, runlabels, runstarts)
+    numpy.minimum.at(uppers, runlabels, runrows)
+    numpy.maximum.at(rights, runlabels, runends)
+    numpy.maximum.at(lowers, runlabels, runrows + 1)
+    firstruns = numpy.unique(runlabels, return_index=True)[1]
+    objects = []
+    for label in range(1, count + 1):
+        object = {}
+        object['label'] = label
+        object['area'] = int(areas[label])
+        # Bounding box uses the same (left, upper, right, lower) layout as PIL
+        object['box'] = (int(lefts[label]), int(uppers[label]), int(rights[label]), int(lowers[label]))
+        firstrun = firstruns[label - 1]
+        object['first'] = (int(runstarts[firstrun]), int(runrows[firstrun]))
+        objects.append(object)
+    return labels, objects
 
 # Colorize distinct objects in a black and white image
 def colorize(blackandwhiteimage, colorset=DISTINCT_COLORS):
-    # Convert the black and white image to RGB
-    image = blackandwhiteimage.convert('RGB')
-    width, height = image.size
-    colorindex = 0
-    colors = []
-    # Color each connected section of black pixels
-    while True:
-        # Choose a new color
-        color = colorset[colorindex]
-        colorindex += 1
-        # Find the first black pixel
-        blackpixel = None
-        for x, y, pixel in walk(image):
-            # Found the first black pixel
-            if pixel == (0, 0, 0):
-                blackpixel = (x,y)
-                break
-        if not blackpixel:
-            # No more black pixels, the image is fully colored
-            break
-        colors.append(color)
-        
-        # Keep track of neighboring black pixels
-        neighbors = [blackpixel]
-        # Keep finding neighbors until we don't find any more black pixels
-        while len(neighbors) > 0:
-            # Make a new list of the current neighbors
-            processing = list(neighbors)
-            # Clear the neighbors we are going to process from the list
-            neighbors = []
-            # Process each of the neighbors
-            for x,y in processing:
-                # Color this neighbor
-                image.putpixel((x,y), color)
-                # Find all of the neighboring pixels
-                new = [(x-1, y), (x+1, y), (x, y-1), (x, y+1)]
-                # Go through the neighbors
-                for x,y in new:
-                    if (x,y) in neighbors:
-                        # Already added, skip
-                        continue
-                    if x < 0 or x >= width:
-                        # Invalid x value, skip
-                        continue
-                    if y < 0 or y >= height:
-                        # Invalid y value, skip
-                        continue
-                    if image.getpixel((x,y)) != (0, 0, 0):
-                        # Non-black pixel, skip
-                        continue
-                    # Add the neighboring black pixel to be processed
-                    neighbors.append((x,y))
+    # Find each connected section of black pixels
+    labels, objects = labelobjects(blackandwhiteimage)
+    if len(objects) > len(colorset):
+        raise IndexError('Not enough colors for %s objects' % len(objects))
+    # Give each section its own color, in the order they were found
+    colors = list(colorset[:len(objects)])
+    # Every black pixel is part of an object, so only the background is left white
+    palette = numpy.array([(255, 255, 255)] + colors, dtype=numpy.uint8)
+    image = Image.fromarray(palette[labels], 'RGB')
     #imagehash = hashlib.md5(image.tostring()).hexdigest()
     #image.save('temp//%s.png' % imagehash)
     return image, colors
 
-# Split the image into distinct objects by colorizing it
+# Split the image into distinct objects by labeling it
+# Each object is a mask the size of its bounding box, along with its offset
+# in the original image, so no full-size copies are made per object
 def colorsplit(image):
-    # Colorize the image
-    image, colors = colorize(image)
-    splitimages = []
-    # Go through each colored object
-    for color in colors:
-        # Make a copy of the image for this object
-        colorimage = image.copy()
-        # Walk through every pixel
-        for x,y, pixel in walk(colorimage):
-            # Ignore this pixel by default and make it white
-            newpixel = (255, 255, 255)
-            if pixel == color:
-                # This pixel is the correct color, make it black
-                newpixel = (0, 0, 0)
-            if pixel != newpixel:
-                # Change the current pixel color to this new one
-                colorimage.putpixel((x,y), newpixel)
-        # Convert the image copy to grayscale
-        colorimage = colorimage.convert('L')
-        # Add this object's image to the list
-        splitimages.append(colorimage)
-    return splitimages
+    labels, objects = labelobjects(image)
+    splits = []
+    # Go through each labeled object
+    for object in objects:
+        left, upper, right, lower = object['box']
+        split = {}
+        # Only this object's pixels are set, other objects in the box are ignored
+        split['mask'] = BinaryFigure.frommask(labels[upper:lower, left:right] == object['label'])
+        split['offset'] = (left, upper)
+        split['size'] = image.size
+        # Add this object's mask to the list
+        splits.append(split)
+    return splits
+    
+# Find the bounding box of a split object in the original image
+def splitbox(split):
+    left, upper = split['offset']
+    width, height = split['mask'].size
+    return (left, upper, left + width, upper + height)
+    
+# Convert a mask into a grayscale image, black where the mask is set
+def maskimage(mask):
+    return mask.toimage('L')
+    
+# Draw a split object back onto a white image the size of the original
+def splitimage(split):
+    image = Image.new('L', split['size'], 255)
+    image.paste(maskimage(split['mask']), split['offset'])
+    return image
     
 # Calculate what kind of symmetry (if any) this image/object has
 def findsymmetry(image):
     # This process is expensive to calculate
     # Check to see if we have already analyzed this same object/image
-    imagehash = hashlib.md5(image.tostring()).hexdigest()
-    if imagehash in hashdb and 'findsymmetry' in hashdb[imagehash]:
+    figure = asbinary(image)
+    contenthash = figure.contenthash()
+    cached = cache.get('findsymmetry', contenthash)
+    if cached:
         # Return the previously calculated values
-        return hashdb[imagehash]['findsymmetry']
-    elif not imagehash in hashdb:
-        hashdb[imagehash] = {}
+        return cached
         
     # Only check these specific angles
     angles = [45, 90, 120, 135, 180, 225, 240, 270, 280, 315]
     symmetries = []
-    # Make an inverted copy of the image for processing
-    inverted = ImageOps.invert(image)
-    for angle in angles:
+    # Find the black pixels of the original image
+    original = figure.mask()
+    height, width = original.shape
+    blackpixels = figure.count()
+    # Stack the re-cropped rotations on top of each other, lined up with the original
+    # Pixels that are off the sides of the original image are left out
+    rotations = numpy.zeros((len(angles), height, width), dtype=bool)
+    for index, angle in enumerate(angles):
         # Rotate and re-crop the image
-        rotated = inverted.rotate(angle, expand=True)
-        rotated = ImageOps.invert(rotated)
-        rotated, rotbox = crop(rotated)
-        blackpixels = 0
-        matchedpixels = 0
-        # Check to see how many pixels are the same in this rotation
-        for x,y,pixel in walk(image):
-            # Ignore all white pixels in the original image
-            if pixel > 0:
-                continue
-            # Keep track of the number of black pixels from the original image
-            blackpixels += 1
-            # Ignore pixels that are off the sides of the new image
-            if x >= rotated.size[0] or y >= rotated.size[1]:
-                continue
-            # Check if the new pixel is also black
-            if rotated.getpixel((x,y)) < 1:
-                # Keep track of how many black pixel matches there have been
-                matchedpixels += 1
+        rotated = rotation.rotatecrop(original, angle)
+        if not rotated.any():
+            # Nothing survived the rotation, so nothing can match
+            continue
+        overlapheight, overlapwidth = min(height, rotated.shape[0]), min(width, rotated.shape[1])
+        rotations[index, :overlapheight, :overlapwidth] = rotated[:overlapheight, :overlapwidth]
+    # Count the black pixels that are also black in each rotation, all angles at once
+    matches = (rotations & original).reshape(len(angles), -1).sum(axis=1)
+    for angle, matchedpixels in zip(angles, matches.tolist()):
         # Calculate the ratio of matched black pixels
         matched = matchedpixels / float(blackpixels)
         # Check if this is above the threshold for a rotation match
@@ -313,10 +455,48 @@ def findsymmetry(image):
         symmetry = 'Half'
         
     # Store this result so that we don't re-calculate it later
-    hashdb[imagehash]['findsymmetry'] = (symmetry, symmetries)
+    cache.put('findsymmetry', contenthash, (symmetry, symmetries))
     # Return the symmetry type and the symmetrical angles
     return symmetry, symmetries
     
+# Find the left-most and right-most set pixels in each row of a mask
+def rowextremes(mask):
+    rows = numpy.nonzero(mask.any(axis=1))[0]
+    lefts = mask[rows].argmax(axis=1)
+    rights = mask.shape[1] - 1 - mask[rows][:, ::-1].argmax(axis=1)
+    return rows, lefts, rights
+    
+# Find lower and upper bounds for the cropped (width, height) of an object image
+# rotated by each of the given angles, without actually rotating it
+# The upper bounds come from projecting the corners of the black pixels
+# The lower bounds come from projecting the centers of solid 2x2 blocks of
+# black pixels, which always leave at least one pixel behind when rotated
+def rotationbounds(image, angles):
+    mask = asbinary(image).mask()
+    # PIL rotates counter-clockwise, with y pointing down
+    radians = -numpy.radians(numpy.array(angles, dtype=float))[:, numpy.newaxis]
+    cos, sin = numpy.cos(radians), numpy.sin(radians)
+    def extents(xs, ys):
+        rotatedxs = cos*xs - sin*ys
+        rotatedys = sin*xs + cos*ys
+        return numpy.column_stack([rotatedxs.max(axis=1) - rotatedxs.min(axis=1), rotatedys.max(axis=1) - rotatedys.min(axis=1)])
+        
+    # Only the outer corners of each row can be the furthest out
+    rows, lefts, rights = rowextremes(mask)
+    xs = numpy.concatenate([lefts, lefts, rights + 1, rights + 1]).astype(float)
+    ys = numpy.concatenate([rows, rows + 1, rows, rows + 1]).astype(float)
+    upper = extents(xs, ys) + 1
+    
+    # Without any solid blocks (very thin objects) there is no useful lower bound
+    lower = numpy.zeros((len(angles), 2))
+    blocks = mask[:-1, :-1] & mask[1:, :-1] & mask[:-1, 1:] & mask[1:, 1:]
+    if blocks.any():
+        rows, lefts, rights = rowextremes(blocks)
+        xs = numpy.concatenate([lefts, rights]).astype(float) + 1
+        ys = numpy.concatenate([rows, rows]).astype(float) + 1
+        lower = numpy.maximum(extents(xs, ys) + 1 - numpy.sqrt(2), 0)
+    return lower, upper
+    
 # Find this image/object's angle offset from the "ideal" angle
 # This is needed because we know objects will be rotated but we
 # aren't comparing them against each other directly
@@ -324,15 +504,18 @@ def findsymmetry(image):
 # and rotate until we find it
 # An object's offset from the ideal angle tells us its relative angle
 # compared to any other object of the same shape
-def findangleoffset(image, symmetry, symmetries):
+# By default only a coarse estimate is made for most angles, set exhaustive
+# to rotate and measure every angle instead (the result is the same)
+def findangleoffset(image, symmetry, symmetries, exhaustive=False):
     # This process is expensive to calculate
     # Check to see if we have already analyzed this same object/image
-    imagehash = hashlib.md5(image.tostring()).hexdigest()
-    if imagehash in hashdb and 'findangleoffset' in hashdb[imagehash]:
+    # The rotated object is returned as a BinaryFigure
+    figure = result = asbinary(image)
+    contenthash = figure.contenthash()
+    cached = cache.get('findangleoffset', contenthash)
+    if cached:
         # Return the previously calculated values
-        return hashdb[imagehash]['findangleoffset']
-    elif not imagehash in hashdb:
-        hashdb[imagehash] = {}
+        return cached
         
     angleoffset = -1
     lastangle = 360
@@ -341,19 +524,38 @@ def findangleoffset(image, symmetry, symmetries):
         lastangle = symmetries[0]
     # Check any kind of object other than full symmetry (circle)
     if symmetry != 'Full':
+        # Go through angles 5 degrees at a time
+        angles = [angle * 5 for angle in range(0, lastangle/5)]
         rotangles = {}
+        mask = figure.mask()
+        # Rotate and crop by the given angle, only once per angle
+        def rotate(angle):
+            if not angle in rotangles:
+                rotangles[angle] = BinaryFigure.frommask(rotation.rotatecrop(mask, angle))
+            return rotangles[angle]
+            
+        # Rotating is expensive, so start with a coarse estimate of the size at every angle
+        # and only rotate the angles that could possibly be one of the lowest sizes
+        lowerareas = {}
+        candidates = angles
+        if not exhaustive:
+            lowerbounds, upperbounds = rotationbounds(figure, range(0, 360, 5))
+            lowersizes = lowerbounds[:, 0] + lowerbounds[:, 1]*.05
+            uppersizes = upperbounds[:, 0] + upperbounds[:, 1]*.05
+            lowerareas = dict(zip(range(0, 360, 5), (lowerbounds[:, 0] * lowerbounds[:, 1]).tolist()))
+            # The real second lowest size can't be bigger than the second lowest upper bound
+            angleuppers = sorted(uppersizes[:len(angles)].tolist())
+            secondupper = angleuppers[min(1, len(angleuppers) - 1)]
+            # Anything that can't get close to the second lowest size is ignored
+            candidates = [angle for angle, lowersize in zip(angles, lowersizes.tolist()) if lowersize <= secondupper * 1.01 + 0.0001]
+            
         lowestsize = None
-        lowestimage = None
         secondlowestsize = None
         lowestangle = None
         # Look for the "ideal" angle
-        # Go through angles 5 degrees at a time
-        for angle in range(0, lastangle/5):
-            angle = angle * 5
+        for angle in candidates:
             # Rotate and crop by the current angle
-            rotated = ImageOps.invert(image).rotate(angle, expand=True)
-            rotated = ImageOps.invert(rotated)
-            rotated, rotbox = crop(rotated)
+            rotated = rotate(angle)
             newwidth, newheight = rotated.size
             # Use a size check that is heavily-weighted 
             newpixels = newwidth + newheight*.05
@@ -364,17 +566,15 @@ def findangleoffset(image, symmetry, symmetries):
                     secondlowestsize = lowestsize
                 lowestsize = newpixels
                 lowestangle = angle
-                lowestimage = rotated
             # Otherwise check if this is the second lowest
             elif not secondlowestsize or newpixels < secondlowestsize:
                 secondlowestsize = newpixels
-            rotangles[angle] = rotated
         
         angleoffset = 0
         if lowestsize:
             # Set the "ideal" angle as the lowest size
             angleoffset = lowestangle
-            image = lowestimage
+            result = rotangles[lowestangle]
         
         # If this is a non-symmetrical shape, do more analysis
         if symmetry == 'None' or symmetry == 'Unknown':
@@ -383,21 +583,23 @@ def findangleoffset(image, symmetry, symmetries):
                 
             # Look for local minima angles in terms of size
             peakangles = {}
-            for angle in list(sorted(rotangles.keys())):
+            for angle in candidates:
                 anglewidth, angleheight = rotangles[angle].size
                 anglesize = anglewidth + angleheight*.05
-                # Check if the counter-clockwise neighbor is lower
-                neighborwidth, neighborheight = rotangles[(angle - 5) % 360].size
-                neighborsize = neighborwidth * neighborheight
-                if anglesize > neighborsize:
-                    continue
-                # Check if the clockwise neighbor is lower
-                neighborwidth, neighborheight = rotangles[(angle + 5) % 360].size
-                neighborsize = neighborwidth * neighborheight
-                if anglesize > neighborsize:
-                    continue
-                # Lower than both neighbors, this is a local minimum angle
-                peakangles[angle] = rotangles[angle]
+                # Check if the counter-clockwise or clockwise neighbor is lower
+                peak = True
+                for neighbor in [(angle - 5) % 360, (angle + 5) % 360]:
+                    if not neighbor in rotangles and anglesize <= lowerareas.get(neighbor, 0):
+                        # Even the smallest possible neighbor size isn't lower, no need to rotate it
+                        continue
+                    neighborwidth, neighborheight = rotate(neighbor).size
+                    neighborsize = neighborwidth * neighborheight
+                    if anglesize > neighborsize:
+                        peak = False
+                        break
+                if peak:
+                    # Lower than both neighbors, this is a local minimum angle
+                    peakangles[angle] = rotangles[angle]
                 
             # Look for angles that are close to the second-lowest angle
             closeangles = {}
@@ -406,7 +608,7 @@ def findangleoffset(image, symmetry, symmetries):
                 anglesize = anglewidth + angleheight*.05
                 if anglesize < secondlowestsize * 1.01:
                     # Close enough to the second-lowest to be counted
-                    closeangles[angle] = peakangles[angle]
+                    closeangles[angle] = peakangles[angle].toimage('L')
             
             # Look for the actual best angle from the filtered list
             # The point of this is to arbitrarily prefer one configuration
@@ -424,23 +626,24 @@ def findangleoffset(image, symmetry, symmetries):
                 score = 1
                 maxscore = 1
                 
-                # Walk through each pixel of this object angle
-                for newx, newy, pixel in walk(closeangles[angle]):
-                    if pixel == 0:
+                # Assign a score to each pixel base on its location
+                # Pixels further to the right and down are scored higher
+                columnmods = numpy.ones(anglewidth, dtype=numpy.int64)
+                columnmods[moreleft + 1:] += 2
+                columnmods[left + 1:] += 2
+                # Walk through each row of this object angle
+                for newy, row in walkrows(closeangles[angle]):
+                    counted = row != 0
+                    pixels = int(counted.sum())
+                    if not pixels:
                         continue
-                    # Assign a score to each pixel base on its location
-                    mod = 1
-                    if newx > moreleft:
-                        mod += 2
-                    if newx > left:
-                        mod += 2
+                    rowmod = 0
                     if newy > moreup:
-                        mod += 1
+                        rowmod += 1
                     if newy > up:
-                        mod += 1
-                    # Pixels further to the right and down are scored higher
-                    maxscore += 7
-                    score += mod
+                        rowmod += 1
+                    maxscore += 7 * pixels
+                    score += int(columnmods[counted].sum()) + rowmod * pixels
                 
                 # Check if this score is the lowest
                 score = score / float(maxscore)
@@ -454,92 +657,115 @@ def findangleoffset(image, symmetry, symmetries):
                 angleoffset = 0
             else:
                 angleoffset = bestangle
-                image = closeangles[bestangle]
+                result = peakangles[bestangle]
                 
     # Store this result so that we don't re-calculate it later
-    hashdb[imagehash]['findangleoffset'] = (angleoffset, image)
-    return angleoffset, image
-    
-# Analyze a black and white image of a single object
-def analyzeobject(image):
-    # Store some basic details about this object/image
-    details = {}
-    details['id'] = id = uuid4().hex
-    cropped, box = crop(image)
-    details['box'] = box
-    details['size'] = width, height = cropped.size
-    details['rotsize'] = cropped.size
-    totalpixels = width * height
-    
-    # Find the type of rotational symmetry (if any) and the symmetrical angles
-    symmetry, symmetries = findsymmetry(cropped)
+    cache.put('findangleoffset', contenthash, (angleoffset, result))
+    return angleoffset, result
+    
+# The pixel metrics calculated for each object, one record per object
+METRICS_DTYPE = numpy.dtype([('width', numpy.int32), ('height', numpy.int32), ('darkness', numpy.float64), ('connectedness', numpy.float64), ('outsideness', numpy.float64), ('aspect', numpy.float64), ('angleoffset', numpy.int32)])
+
+# Calculate the pixel metrics of a list of object masks all at once
+# The masks are stacked into one array padded with white, so each metric is a
+# few array operations over every object instead of a loop over every pixel
+# Returns a structured array of METRICS_DTYPE records in the same order as the masks
+def objectmetrics(masks):
+    metrics = numpy.zeros(len(masks), dtype=METRICS_DTYPE)
+    metrics['angleoffset'] = -1
+    if not masks:
+        return metrics
+    heights = numpy.array([mask.shape[0] for mask in masks])
+    widths = numpy.array([mask.shape[1] for mask in masks])
+    stack = numpy.zeros((len(masks), heights.max(), widths.max()), dtype=bool)
+    for index, mask in enumerate(masks):
+        stack[index, :mask.shape[0], :mask.shape[1]] = mask
+    totalpixels = (widths * heights).astype(numpy.float64)
+    
+    # Count the black pixels
+    darkpixels = stack.sum(axis=(1, 2))
+    
+    # Each pair of neighboring black pixels counts a quarter for both pixels
+    # Count the pairs by comparing the masks against themselves shifted by one pixel
+    horizontalpairs = (stack[:, :, 1:] & stack[:, :, :-1]).sum(axis=(1, 2))
+    verticalpairs = (stack[:, 1:, :] & stack[:, :-1, :]).sum(axis=(1, 2))
+    connectedpixels = (horizontalpairs + verticalpairs) * 0.5
+    
+    # Count the white pixels before the first and after the last black pixel of each row
+    # Rows without any black pixels don't count
+    rows = stack.any(axis=2)
+    firstdark = stack.argmax(axis=2)
+    lastdark = stack.shape[2] - 1 - stack[:, :, ::-1].argmax(axis=2)
+    outsidepixels = ((firstdark + (widths[:, None] - lastdark - 1)) * rows).sum(axis=1)
+    
+    # Calculate the metrics for each object
+    metrics['width'] = widths
+    metrics['height'] = heights
+    metrics['darkness'] = darkpixels / totalpixels
+    metrics['connectedness'] = connectedpixels / darkpixels
+    metrics['outsideness'] = outsidepixels / totalpixels
+    metrics['aspect'] = widths / heights.astype(numpy.float64)
+    return metrics
+    
+# Analyze a single split object
+def analyzeobject(split):
+    alldetails, metrics = analyzeobjects([split])
+    return alldetails[0]
+    
+# Analyze a list of split objects, for example every object in a problem
+# Returns the details of each object, along with a structured array of the
+# metrics of each object (see METRICS_DTYPE) in the same order
+def analyzeobjects(splits):
+    alldetails = []
+    uncached = []
+    for split in splits:
+        # Store some basic details about this object/image
+        details = {}
+        details['id'] = uuid4().hex
+        details['box'] = splitbox(split)
+        alldetails.append(details)
         
-    # Find the object's absolute roation compared to the "ideal" angle for this shape
-    angleoffset, cropped = findangleoffset(cropped, symmetry, symmetries)
-    
-    # Keep track of various stats for this object
-    width, height = cropped.size
-    details['rotsize'] = cropped.size
-    totalpixels = width * height
-    darkpixels = 0
-    connectedpixels = 0
-    outsidepixels = 0
-    currenty = 0
-    firstdark = 999999999
-    lastdark = -1
-    
-    # Go through all of the pixels
-    for x,y,pixel in walk(cropped):
-        # Check if this is a new line
-        if currenty != y:
-            currenty = y
-            # Check if there any black pixels
-            if firstdark < 999999999 and lastdark > -1:
-                # Add the number of white pixels before the first black one
-                outsidepixels += firstdark
-                # Add the number of white pixels after the last black one
-                outsidepixels += width - lastdark - 1
-            # Reset the first/last markers for this new line
-            firstdark = 999999999
-            lastdark = -1
-            
-        # Check if this is a black pixel
-        if pixel != 255:
-            # Keep track of the total number of black pixels
-            darkpixels += 1
-            
-            # Keep track of the first/last black pixels for this line
-            if firstdark > x:
-                firstdark = x
-            if lastdark < x:
-                lastdark = x
-            
-            # Check if any neighboring pixels are black
-            neighbors = [(x-1, y), (x+1, y), (x, y-1), (x, y+1)]
-            for x2, y2 in neighbors:
-                if x2 < 0 or x2 >= width:
-                    continue
-                if y2 < 0 or y2 >= height:
-                    continue
-                if cropped.getpixel((x2, y2)) != 255:
-                    connectedpixels += 0.25
-    
-    # Add the last line's outside white pixels
-    if firstdark < 999999999 and lastdark > -1:
-        outsidepixels += firstdark
-        outsidepixels += width - lastdark - 1
-            
-    # Calculate that metrics for this object
-    details['darkness'] = darkpixels / float(totalpixels)
-    details['connectedness'] = connectedpixels / float(darkpixels)
-    details['outsideness'] = outsidepixels / float(totalpixels)
-    details['symmetry'] = symmetry
-    details['aspect'] = width / float(height)
-    if angleoffset > -1:
-        details['angleoffset'] = angleoffset
+        # Everything other than the id and box only depends on the object's pixels
+        # Check to see if we have already analyzed this same object
+        contenthash = split['mask'].contenthash()
+        cached = cache.get('analyzeobject', contenthash)
+        if cached:
+            details.update(cached)
+            continue
+        
+        # The mask is already cropped to the object's bounding box
+        cropped = split['mask']
+        details['size'] = cropped.size
+        
+        # Find the type of rotational symmetry (if any) and the symmetrical angles
+        with instrumentation.span('analyze.symmetry'):
+            symmetry, symmetries = findsymmetry(cropped)
+        details['symmetry'] = symmetry
+        
+        # Find the object's absolute roation compared to the "ideal" angle for this shape
+        with instrumentation.span('analyze.angle'):
+            angleoffset, cropped = findangleoffset(cropped, symmetry, symmetries)
+        details['rotsize'] = cropped.size
+        if angleoffset > -1:
+            details['angleoffset'] = angleoffset
+        uncached.append((details, contenthash, cropped.mask()))
+        
+    # Calculate the pixel metrics of all of the new objects together
+    with instrumentation.span('analyze.metrics'):
+        newmetrics = objectmetrics([mask for details, contenthash, mask in uncached])
+    for (details, contenthash, mask), record in zip(uncached, newmetrics):
+        for key in ('darkness', 'connectedness', 'outsideness', 'aspect'):
+            details[key] = float(record[key])
+        # Store these results so that we don't re-calculate them later
+        cache.put('analyzeobject', contenthash, dict((key, value) for key, value in details.items() if key != 'id' and key != 'box'))
         
+    # Collect the metrics of every object, including the cached ones
+    metrics = numpy.zeros(len(alldetails), dtype=METRICS_DTYPE)
+    for index, details in enumerate(alldetails):
+        width, height = details['rotsize']
+        metrics[index] = (width, height, details['darkness'], details['connectedness'], details['outsideness'], details['aspect'], details.get('angleoffset', -1))
     # Return all of the calculations
-    return details
+    return alldetails, metrics
     
 # Find the relationships between two boundary boxes
 def compareboxes(box, otherbox):
@@ -564,83 +790,255 @@ def compareboxes(box, otherbox):
         
     return relationships
     
-# Analyze a set of figure images for a problem, and return the problem definition
-def analyze(figureimages):
-    # Process the figure images and split them into individual object images
-    figures = {}
-    for figurename, figurepath in list(sorted(figureimages.items())):
+# Open the figure store the first time it's needed, if there is one
+def openstore():
+    global store
+    if store is None:
+        store = False
+        if FIGURE_STORE and os.path.isfile(FIGURE_STORE):
+            store = figurestore.FigureStore(FIGURE_STORE)
+    return store
+    
+# Use a different figure store file, or None to stop using a store
+def usestore(path):
+    global FIGURE_STORE, store
+    FIGURE_STORE = path
+    store = None
+    
+# Open a figure image and split it into individual object images
+def loadfigure(figurename, figurepath):
+    image = None
+    if openstore():
+        # Read the already binarized figure from the store
+        image = store.get(figurepath)
+    if image is None:
         image = Image.open(figurepath)
         image = blackandwhite(image)
-        figure = {}
-        figure['name'] = figurename
-        figure['file'] = figurepath
-        figure['image'] = image
-        figure['splits'] = colorsplit(image)
-        figures[figurename] = figure
+    figure = {}
+    figure['name'] = figurename
+    figure['file'] = figurepath
+    figure['image'] = image
+    figure['splits'] = colorsplit(image)
+    return figure
+    
+# Open a figure image, split it and analyze all of its objects
+# This is what each worker process runs when analyzing figures in parallel
+def analyzefigure(item):
+    figurename, figurepath = item
+    # Time this figure on its own, the stage timings are sent back with the figure
+    instrumentation.begin(figurename)
+    with instrumentation.span('analyze.segment'):
+        figure = loadfigure(figurename, figurepath)
+    figure['details'], figure['metrics'] = analyzeobjects(figure['splits'])
+    figure['timings'] = instrumentation.end(keep=False)['stages']
+    # Worker processes don't run exit handlers, so save any new results now
+    cache.flush()
+    return figure
+    
+# Get a pool of worker processes for analyzing figures
+# The pool is kept between problems, starting new processes for every problem would be slow
+def workerpool(workers):
+    global pool, poolworkers
+    if pool is None or poolworkers != workers:
+        if pool is not None:
+            pool.terminate()
+        # Save any pending results first, so the workers can find them
+        cache.flush()
+        pool = multiprocessing.Pool(workers)
+        poolworkers = workers
+    return pool
+
+# Stop the worker processes, the next figures analyzed in parallel start new ones
+def closepool():
+    global pool, poolworkers
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+    pool = None
+    poolworkers = 0
+    
+# Check if an object's outsideness is close enough to an object already in a shape
+# outsides is the sorted outsideness of every object in the shape, and
+# symmetryoutsides the same for the objects of each symmetry type
+def shapematch(object, outsides, symmetryoutsides):
+    outside = object['outsideness']
+    # Objects with the same symmetry type are allowed to be a little further apart
+    if 'symmetry' in object and object['symmetry'] in symmetryoutsides:
+        values = symmetryoutsides[object['symmetry']]
+        # Only the objects in a window around this outsideness can be close enough
+        index = bisect.bisect_left(values, outside - 0.0801)
+        while index < len(values) and values[index] < outside + 0.0801:
+            diff = abs(values[index] - outside)
+            # Reduce the difference somewhat to account for the similarity
+            diff -= 0.05
+            if diff < 0.03:
+                return True
+            index += 1
+    index = bisect.bisect_left(outsides, outside - 0.0301)
+    while index < len(outsides) and outsides[index] < outside + 0.0301:
+        if abs(outsides[index] - outside) < 0.03:
+            return True
+        index += 1
+    return False
+    
+# Partition a list of objects into distinct shapes
+# Each shape is built with one pass over the objects that are left, in order
+# The first object starts the shape, and every other object joins it if its
+# outsideness is close to any object already in the shape
+# Returns the list of shapes, each a list of objects
+def partitionshapes(objects):
+    shapes = []
+    remaining = objects
+    while remaining:
+        shape = []
+        outsides = []
+        symmetryoutsides = {}
+        left = []
+        for object in remaining:
+            # Add the first object by default, otherwise check if it's close enough
+            if shape and not shapematch(object, outsides, symmetryoutsides):
+                left.append(object)
+                continue
+            shape.append(object)
+            bisect.insort(outsides, object['outsideness'])
+            if 'symmetry' in object:
+                bisect.insort(symmetryoutsides.setdefault(object['symmetry'], []), object['outsideness'])
+        shapes.append(shape)
+        remaining = left
+    return shapes
+    
+# Find the size bin for an object's size
+# An object joins an existing bin if the sizes are within 25% of the larger size,
+# or gets its own bin (its own size) if none are that close
+# binsizes is the sorted list of the existing bins, which are the keys of bins
+def sizebin(size, binsizes, bins):
+    # Only bins from 75% to 133% of this size can be close enough
+    start = bisect.bisect_left(binsizes, size * 0.75 - 1)
+    end = bisect.bisect_right(binsizes, size / 0.75 + 1)
+    matches = []
+    for existingsize in binsizes[start:end]:
+        bigsize, smallsize = size, existingsize
+        if existingsize > size:
+            bigsize, smallsize = smallsize, bigsize
+        # Figure out the difference between this size and the existing one
+        diff = bigsize - smallsize
+        if diff < bigsize * 0.25:
+            matches.append(existingsize)
+    if not matches:
+        return size
+    if len(matches) == 1:
+        return matches[0]
+    # When more than one bin is close enough, use the first one in bins, as always
+    for existingsize in bins:
+        if existingsize in matches:
+            return existingsize
+    
+# Index the bounding boxes of a figure's objects by their left and top sides,
+# so the relationships between the boxes can be found without comparing every pair
+def indexboxes(objects):
+    index = {}
+    index['objects'] = objects
+    index['byleft'] = sorted(range(len(objects)), key=lambda position: objects[position]['box'][0])
+    index['lefts'] = [objects[position]['box'][0] for position in index['byleft']]
+    index['bytop'] = sorted(range(len(objects)), key=lambda position: objects[position]['box'][1])
+    index['tops'] = [objects[position]['box'][1] for position in index['bytop']]
+    return index
+    
+# Find the relationships between an object's box and the other boxes in an index
+# The results are the same as compareboxes against each of the other objects
+# Returns the related objects for each relationship, in the same order as the index
+def findboxrelationships(object, index):
+    objects = index['objects']
+    boxupx, boxupy, boxdownx, boxdowny = object['box']
+    boxcenterx, boxcentery = boxupx + (boxdownx - boxupx)/2.0, boxupy + (boxdowny - boxupy)/2.0
+    found = {}
+    
+    # The box is inside boxes that start further left, if they also surround it on the other sides
+    positions = []
+    for position in index['byleft'][:bisect.bisect_left(index['lefts'], boxupx)]:
+        oboxupx, oboxupy, oboxdownx, oboxdowny = objects[position]['box']
+        if boxupy > oboxupy and boxdownx < oboxdownx and boxupy < oboxdowny:
+            positions.append(position)
+    found['inside'] = positions
+    
+    # The box is left of boxes that start right of its center
+    found['left-of'] = index['byleft'][bisect.bisect_right(index['lefts'], boxcenterx):]
+    
+    # The box is above boxes that start below its center
+    found['above'] = index['bytop'][bisect.bisect_right(index['tops'], boxcentery):]
+    
+    relationships = {}
+    for relationship, positions in found.items():
+        others = [objects[position] for position in sorted(positions) if objects[position]['id'] != object['id']]
+        if others:
+            relationships[relationship] = others
+    return relationships
+    
+# Analyze a set of figure images for a problem, and return the problem definition
+# Set workers above 1 to analyze the figures in parallel worker processes
+# Set debugrender to write debug composites of the figures to DEBUG_DIRECTORY
+def analyze(figureimages, workers=None, debugrender=None):
+    if workers is None:
+        workers = WORKERS
+    if debugrender is None:
+        debugrender = DEBUG_RENDER
+    figureitems = list(sorted(figureimages.items()))
+    figures = {}
+    splitfigures = []
+    splits = []
+    if workers > 1:
+        # Process the figure images and analyze their objects in parallel
+        analyzed = workerpool(workers).map(analyzefigure, figureitems)
+        for figure in analyzed:
+            figures[figure['name']] = figure
+            # Add the workers' stage timings to this process
+            instrumentation.merge(figure.pop('timings'))
+        # Merge all of the figures' objects in figure order
+        alldetails = []
+        allmetrics = [numpy.zeros(0, dtype=METRICS_DTYPE)]
+        for figure in analyzed:
+            for details in figure.pop('details'):
+                # Give out the ids here, in the same order as when analyzing sequentially
+                details['id'] = uuid4().hex
+                splitfigures.append(figure['name'])
+                alldetails.append(details)
+            allmetrics.append(figure.pop('metrics'))
+        metrics = numpy.concatenate(allmetrics)
+    else:
+        # Process the figure images and split them into individual object images
+        with instrumentation.span('analyze.segment'):
+            for figurename, figurepath in figureitems:
+                figures[figurename] = loadfigure(figurename, figurepath)
+        for figurename, figure in list(sorted(figures.items())):
+            for object in figure['splits']:
+                splitfigures.append(figurename)
+                splits.append(object)
+        # Analyze all of the objects of the problem together
+        alldetails, metrics = analyzeobjects(splits)
+        
+    if debugrender:
+        renderfigures(figures)
         
-    printfigures(figures)
     prob = {}
     objects = {}
-    
-    # Go through each figure's objects and check for angles and fills
+    for figurename in figures:
+        prob[figurename] = {}
+    for figurename, details in zip(splitfigures, alldetails):
+        details['figure'] = figurename
+        objects[details['id']] = details
+        
+    # Check for angles and fills across all of the objects
     # If there are no fills or no angles, those details won't be added to the problem
     fillmin = 0.5
-    anyfills = False
-    anyangles = False
-    for figurename, figure in list(sorted(figures.items())):
-        prob[figurename] = {}
-        for object in figure['splits']:
-            details = analyzeobject(object)
-            details['figure'] = figurename
-            objects[details['id']] = details
-            #imagehash = hashlib.md5(object.tostring()).hexdigest()
-            #object.save('temp//%s.png' % imagehash)
-            #import fileutils
-            #fileutils.dump(details, 'temp//%s.txt' % imagehash)
-            if details['darkness'] > fillmin:
-                anyfills = True
-            if 'angleoffset' in details and details['angleoffset'] > 0:
-                anyangles = True
+    anyfills = bool((metrics['darkness'] > fillmin).any())
+    anyangles = bool((metrics['angleoffset'] > 0).any())
     
     # Partition the objects into distinct shapes
+    partitionstart = instrumentation.start()
     shapes = {}
-    used = []
-    while True:
+    for shapeindex, shape in enumerate(partitionshapes(list(sorted(objects.values())))):
         # Give each shape an arbitrary name
-        shapeindex = len(shapes) + 1
-        shapename = 'shape' + str(shapeindex)
-        # Go through each object
-        shape = []
-        for object in list(sorted(objects.values())):
-            # Check if this object is already assigned to a shape
-            if object['id'] in used:
-                continue
-            # Check if this shape has no objects yet
-            if not shape:
-                # Add this object by default as the first object of this shape
-                shape.append(object)
-                continue
-            # Go through each existing object assigned to this shape
-            for shapeobject in shape:
-                # Check the difference in outside shape
-                diff = abs(shapeobject['outsideness'] - object['outsideness'])
-                # Check to see if the symmetry types are the same
-                if 'symmetry' in shapeobject and 'symmetry' in object:
-                    rotationmatch = (shapeobject['symmetry'] == object['symmetry'])
-                    if rotationmatch:
-                        # Reduce the difference somewhat to account for the similarity
-                        diff -= 0.05
-                if diff < 0.03:
-                    # Close enough, add this object to the shape
-                    shape.append(object)
-                    break
-        # Check if no objects were added to this shape
-        if not shape:
-            # Stop looking for new shapes, we are out of objects
-            break
-        # Mark all of the objects for this shape as used
-        for object in shape:
-            used.append(object['id'])
+        shapename = 'shape' + str(shapeindex + 1)
         # Save the objects of this shape
         shapes[shapename] = shape
         
@@ -752,25 +1150,17 @@ def analyze(figureimages):
     # Find the relative size of each object within a shape
     for shapename, shape in list(sorted(shapes.items())):
         shapesizes[shapename] = {}
+        # The existing sizes in the shape, kept sorted
+        binsizes = []
         # Partition the objects into size bins
         for object in shape:
             width, height = object['rotsize']
             # By default use the actual size of this object as a key
-            size = width * height
-            # Look through the existing sizes in the shape
-            for existingsize in shapesizes[shapename]:
-                bigsize, smallsize = size, existingsize
-                if existingsize > size:
-                    bigsize, smallsize = smallsize, bigsize
-                # Figure out the difference between this size and the existing one
-                diff = bigsize - smallsize
-                if diff < bigsize * 0.25:
-                    # Close enough, assign this object to the existing size value
-                    size = existingsize
-                    break
+            size = sizebin(width * height, binsizes, shapesizes[shapename])
             # Add a slot for this size if it doesn't exist already
             if not size in shapesizes[shapename]:
                 shapesizes[shapename][size] = []
+                bisect.insort(binsizes, size)
             # Add this object to the chosen size
             shapesizes[shapename][size].append(object)
             
@@ -794,23 +1184,40 @@ def analyze(figureimages):
             for object in shapesizes[shapename][size]:
                 sizes[sizename].append(object)
         
+    instrumentation.stop('analyze.partition', partitionstart)
+        
     # Give each object an arbitrary unique name
-    for index, object in enumerate(list(sorted(objects.values()))):
+    describestart = instrumentation.start()
+    orderedobjects = list(sorted(objects.values()))
+    for index, object in enumerate(orderedobjects):
         objectname = 'O' + str(index+1)
         object['name'] = objectname
+        
+    # Look up each object's shape and size by id, rather than searching the lists
+    objectshapes = {}
+    for shapename, shape in list(sorted(shapes.items())):
+        for object in shape:
+            objectshapes[object['id']] = shapename
+    objectsizes = {}
+    for sizename, size in list(sorted(sizes.items())):
+        for object in size:
+            objectsizes[object['id']] = sizename
+            
+    # Index the boxes of each figure's objects, keeping the objects in name order
+    figureobjects = {}
+    for object in orderedobjects:
+        figureobjects.setdefault(object['figure'], []).append(object)
+    boxindexes = dict((figurename, indexboxes(figureobjectlist)) for figurename, figureobjectlist in figureobjects.items())
     
     # Fill in the official properties of each object in the problem
-    for index, object in enumerate(list(sorted(objects.values()))):
+    for index, object in enumerate(orderedobjects):
         description = {}
         figurename = object['figure']
         objectname = object['name']
-        box = object['box']
-        for shapename, shape in list(sorted(shapes.items())):
-            if object in shape:
-                description['shape'] = [shapename]
-        for sizename, size in list(sorted(sizes.items())):
-            if object in size:
-                description['size'] = [sizename]
+        if object['id'] in objectshapes:
+            description['shape'] = [objectshapes[object['id']]]
+        if object['id'] in objectsizes:
+            description['size'] = [objectsizes[object['id']]]
         if anyfills:
             # Check if the object is dark enough to be considered filled
             if object['darkness'] > fillmin:
@@ -821,22 +1228,10 @@ def analyze(figureimages):
         if anyangles and angleshapes and 'angleoffset' in object:
             # Angles are relevant, record the angle value
             description['angle'] = [object['angleoffset']]
-        # Find the relative values compared to other objects
-        for otherobject in list(sorted(objects.values())):
-            if otherobject['id'] == object['id']:
-                continue
-            if otherobject['figure'] != figurename:
-                continue
-            othername = otherobject['name']
-            otherbox = otherobject['box']
-            # Find the relationships between this two objects
-            relationships = compareboxes(box, otherbox)
-            if relationships:
-                for relationship in relationships:
-                    if not relationship in description:
-                        description[relationship] = []
-                    # Add this relative relationship to the description
-                    description[relationship].append(othername)
+        # Find the relative values compared to other objects in the same figure
+        for relationship, otherobjects in findboxrelationships(object, boxindexes[figurename]).items():
+            # Add this relative relationship to the description
+            description[relationship] = [otherobject['name'] for otherobject in otherobjects]
         # Check if adding a symmetry value would be redundant
         if description['shape'][0].startswith('shape') and 'symmetry' in object and object['symmetry'] != 'Unknown':
             # This shape needs a symmetry designation, so add it
@@ -844,4 +1239,5 @@ def analyze(figureimages):
             
         # Add the description of this object to the problem definition
         prob[figurename][objectname] = description
+    instrumentation.stop('analyze.describe', describestart)
     return prob
\ No newline at end of file
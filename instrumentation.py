@@ -0,0 +1,159 @@
+# Lightweight timing of the stages of solving a problem
+# Code marks a stage with "with instrumentation.span('name'):", and the time spent
+# in it is added up for the current problem and for the whole run
+# Events like cache hits can be counted the same way with instrumentation.count('name')
+# The totals are written as a JSON report, next to Results.txt by default
+
+# Import Python library modules
+import json, threading
+from contextlib import contextmanager
+from timeit import default_timer
+
+# The default report file, in the same directory as Results.txt
+DEFAULT_PATH = 'Timings.json'
+# Where save writes the report when no path is given, set to None to not write it
+REPORT_PATH = DEFAULT_PATH
+# Set to False to skip timing altogether
+ENABLED = True
+
+# Timing can also be turned off for just one thread (see disabled)
+local = threading.local()
+
+# Check whether timing is on for the current thread
+def enabled():
+    return ENABLED and not getattr(local, 'disabled', False)
+
+# Keeps the number of calls and total seconds of each named stage, per problem and per run
+class Timings(object):
+
+    def __init__(self):
+        # The finished problems, in the order they were solved
+        self.problems = []
+        # The problem being solved right now, if any
+        self.current = None
+        # The totals of every stage over the whole run
+        self.run = {}
+        # The totals of every counter over the whole run
+        self.counters = {}
+
+    # Start timing a new problem, stages are added to it until end is called
+    def begin(self, problemname, problemtype=None):
+        self.current = {'name':problemname, 'type':problemtype, 'stages':{}, 'counters':{}}
+
+    # Finish the current problem and return its timings
+    # Set keep to False to not include the problem in the report
+    def end(self, keep=True):
+        problem = self.current
+        self.current = None
+        if problem is not None and keep:
+            self.problems.append(problem)
+        return problem
+
+    # Add time spent in a stage, to the current problem (if any) and to the run
+    def add(self, stage, seconds, count=1):
+        totals = [self.run]
+        if self.current is not None:
+            totals.append(self.current['stages'])
+        for stages in totals:
+            if not stage in stages:
+                stages[stage] = [0, 0.0]
+            stages[stage][0] += count
+            stages[stage][1] += seconds
+
+    # Count an event, for the current problem (if any) and for the run
+    def count(self, counter, amount=1):
+        totals = [self.counters]
+        if self.current is not None:
+            totals.append(self.current['counters'])
+        for counters in totals:
+            counters[counter] = counters.get(counter, 0) + amount
+
+    # Add the stage timings of another process, from the stages of a problem it ended
+    # and optionally its counters
+    def merge(self, stages, counters=None):
+        for stage, (count, seconds) in stages.items():
+            self.add(stage, seconds, count)
+        for counter, amount in (counters or {}).items():
+            self.count(counter, amount)
+
+    # Time the code inside a with statement as the given stage
+    @contextmanager
+    def span(self, stage):
+        if not enabled():
+            yield
+            return
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.add(stage, default_timer() - start)
+
+    # Build the report of every problem and the run as plain dicts and lists
+    def report(self):
+        def stagereport(stages):
+            return dict((stage, {'count':count, 'seconds':seconds}) for stage, (count, seconds) in stages.items())
+        problems = []
+        for problem in self.problems:
+            problems.append({'name':problem['name'], 'type':problem['type'], 'stages':stagereport(problem['stages']), 'counters':problem.get('counters', {})})
+        return {'problems':problems, 'run':stagereport(self.run), 'counters':self.counters}
+
+    # Write the report to a JSON file, along with any extra sections given
+    def save(self, path=DEFAULT_PATH, extra=None):
+        report = self.report()
+        report.update(extra or {})
+        with open(path, 'w') as reportfile:
+            json.dump(report, reportfile, indent=1, sort_keys=True)
+
+# The timings of this process, used by the module functions below
+timings = Timings()
+
+# Shortcuts for the timings of this process
+def begin(problemname, problemtype=None):
+    timings.begin(problemname, problemtype)
+
+def end(keep=True):
+    return timings.end(keep)
+
+def merge(stages, counters=None):
+    timings.merge(stages, counters)
+
+def span(stage):
+    return timings.span(stage)
+
+def count(counter, amount=1):
+    if enabled():
+        timings.count(counter, amount)
+
+# Turn timing off for the current thread inside a with statement
+# For background work that shouldn't be added to the problem being solved
+@contextmanager
+def disabled():
+    wasdisabled = getattr(local, 'disabled', False)
+    local.disabled = True
+    try:
+        yield
+    finally:
+        local.disabled = wasdisabled
+
+# For stages that don't fit in a with statement, get a start time here
+# and pass it to stop at the end of the stage
+def start():
+    return default_timer()
+
+# Returns the seconds since the start time
+def stop(stage, starttime):
+    seconds = default_timer() - starttime
+    if enabled():
+        timings.add(stage, seconds)
+    return seconds
+
+# Get the seconds spent in each stage of the current problem so far
+def currentstages():
+    if timings.current is None:
+        return {}
+    return dict((stage, seconds) for stage, (count, seconds) in timings.current['stages'].items())
+
+def save(path=None, extra=None):
+    path = path or REPORT_PATH
+    if path:
+        timings.save(path, extra)
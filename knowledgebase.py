@@ -1,5 +1,16 @@
 # Some methods for keeping track of knowledge across problems
 
+# Import Python library modules
+import os
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Change this whenever the layout of the knowledge base changes,
+# so old snapshots aren't loaded into the new layout
+SNAPSHOT_VERSION = 1
+
 # Load the attributes of the current problem into the knowledge base
 def scanattributes(knowledgebase, prob):
     # Get a list of object labels (used later to figure out if values are referring to objects)
@@ -109,6 +120,44 @@ def analyzeanswer(knowledgebase, prob, answer, differ):
                 diffs['transform'][description] += 1
     
 
+# Combine two of the 'unknown', 'always', 'never' or 'sometimes' states used by scanattributes
+def mergestate(state, otherstate):
+    if otherstate == 'unknown':
+        return state
+    if state == 'unknown' or state == otherstate:
+        return otherstate
+    return 'sometimes'
+
+# Merge knowledge learned separately (for example in another process) into a knowledge base
+# learned is a knowledge base that started empty, and had some problems scanned and
+# analyzed into it; the counts, values and states end up the same as if those problems
+# had been scanned and analyzed into this knowledge base, in the same order
+# learned's attributes should be an OrderedDict, so new attributes are added in the order
+# they were first seen (updateknowledge breaks ties between attributes in dict order)
+# Call updateknowledge afterwards to update the priorities and percentages
+def mergeknowledge(knowledgebase, learned):
+    if 'attributes' in learned:
+        if not 'attributes' in knowledgebase:
+            knowledgebase['attributes'] = {}
+        attributes = knowledgebase['attributes']
+        for attribute, learnedinfo in list(learned['attributes'].items()):
+            if not attribute in attributes:
+                attributes[attribute] = {'values':[], 'relative':'unknown', 'multi':'unknown', 'count':0}
+            info = attributes[attribute]
+            info['count'] += learnedinfo['count']
+            info['relative'] = mergestate(info['relative'], learnedinfo['relative'])
+            info['multi'] = mergestate(info['multi'], learnedinfo['multi'])
+            for value in learnedinfo['values']:
+                if not value in info['values']:
+                    info['values'].append(value)
+    if 'diffs' in learned:
+        if not 'diffs' in knowledgebase:
+            knowledgebase['diffs'] = {'transpose':{}, 'transform':{}}
+        for kind, counts in list(learned['diffs'].items()):
+            diffs = knowledgebase['diffs'][kind]
+            for description, count in list(counts.items()):
+                diffs[description] = diffs.get(description, 0) + count
+
 # Update the knowledge base to account for the latest information
 def updateknowledge(knowledgebase):
     # Sort the attributes by the count of how many times they have been seen
@@ -215,4 +264,34 @@ def findobjectnames(knowledgebase, prob):
                     nonunique += 1
                     uniquename = '%s %s' % (nonuniquename, nonunique)
             figurenames[objectname] = uniquename.strip()
-    return allnames
\ No newline at end of file
+    return allnames
+
+# Save a snapshot of a knowledge base (attributes, diffs, priorities and percentages),
+# so a later run can start with everything already learned
+# The snapshot is written to a temporary file first, so a half-written one is never loaded
+def savesnapshot(knowledgebase, path):
+    snapshot = {'version':SNAPSHOT_VERSION, 'knowledgebase':knowledgebase}
+    temppath = path + '.tmp'
+    with open(temppath, 'wb') as snapshotfile:
+        pickle.dump(snapshot, snapshotfile, pickle.HIGHEST_PROTOCOL)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temppath, path)
+
+# Load a knowledge base snapshot saved by savesnapshot
+# Returns None if there is no snapshot, or it can't be read, or it's from a different version
+def loadsnapshot(path):
+    if not path or not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as snapshotfile:
+            snapshot = pickle.load(snapshotfile)
+    except Exception as error:
+        # A corrupt snapshot can fail in many ways (ValueError, ImportError, KeyError...),
+        # none of them should stop the agent from starting
+        print('Knowledge snapshot %s could not be read (%s: %s), starting without it' % (path, type(error).__name__, error))
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION or not isinstance(snapshot.get('knowledgebase'), dict):
+        print('Knowledge snapshot %s is not a version %s snapshot, starting without it' % (path, SNAPSHOT_VERSION))
+        return None
+    return snapshot['knowledgebase']
@@ -0,0 +1,151 @@
+# Solve the problem sets in parallel worker processes, like the Project drivers
+# The problems are loaded and Results.txt is written exactly like Project1-4.py do,
+# in the same order, but the problems are solved by a pool of processes, each
+# with its own Agent
+# There are two modes:
+#   sharded (the default): each worker's Agent learns from whatever problems it
+#     happens to solve, so answers can differ from a serial run
+#   frozen: the sets are solved one at a time, every problem in a set is solved
+#     with the knowledge base as it was at the start of the set, and then what was
+#     learned from each problem is merged back in the original order
+# Run this module from the directory with the problem folders:
+#   python parallelrunner.py [--visual] [--workers N] [--frozen]
+# Use --load-knowledge to start every worker from a knowledge base snapshot
+
+# Import Python library modules
+import os, sys, copy, argparse, multiprocessing
+from collections import OrderedDict
+
+# Import the problem loaders used by the Project drivers
+from ProblemSet import ProblemSet
+from VisualProblemSet import VisualProblemSet
+
+# Import required modules
+import knowledgebase, images, instrumentation
+
+# The folders the Project drivers read problems from
+VERBAL_DIRECTORY = 'Problems'
+VISUAL_DIRECTORY = 'Problems (Image Data)'
+
+# The Agent of each worker process
+agent = None
+
+# Load the problem sets the same way the Project drivers do, in the same order
+def loadsets(visual=False):
+    sets = []
+    if visual:
+        for setname in os.listdir(VISUAL_DIRECTORY):
+            newset = VisualProblemSet(setname)
+            sets.append(newset)
+            for problemname in os.listdir(VISUAL_DIRECTORY + os.sep + setname):
+                newset.addProblem(setname, problemname)
+    else:
+        for setname in os.listdir(VERBAL_DIRECTORY):
+            newset = ProblemSet(setname)
+            sets.append(newset)
+            for problemname in os.listdir(VERBAL_DIRECTORY + os.sep + setname):
+                with open(VERBAL_DIRECTORY + os.sep + setname + os.sep + problemname) as problemfile:
+                    newset.addProblem(problemfile)
+    return sets
+
+# Set up a worker process with its own Agent, starting from a knowledge snapshot if given
+def startworker(loadknowledge=None):
+    global agent
+    import Agent as agentmodule
+    agentmodule.LOAD_KNOWLEDGE = loadknowledge
+    agent = agentmodule.Agent()
+    # Workers can't start their own pools, and the parent writes the timing report
+    images.WORKERS = 1
+    instrumentation.REPORT_PATH = None
+
+# Solve one problem in a worker process
+# frozen is the knowledge base to solve with, or None to use the worker's own
+# Returns the answer, the problem's stage timings and, when frozen, what was learned
+def solveproblem(task):
+    problem, frozen = task
+    if frozen is not None:
+        agent.knowledgebase = copy.deepcopy(frozen)
+        # Keep the new attributes in the order they were seen, so they're merged in that order
+        agent.newknowledge = {'attributes':OrderedDict()}
+    timedproblems = len(instrumentation.timings.problems)
+    answer = agent.Solve(problem)
+    timings = None
+    if len(instrumentation.timings.problems) > timedproblems:
+        timings = instrumentation.timings.problems[-1]
+    return answer, timings, agent.newknowledge
+
+# Solve every problem of every set in a pool of worker processes
+# Returns the (answer, timings, learned knowledge) of each problem of each set, in order,
+# and the knowledge base learned when frozen
+def solvesets(sets, workers, frozen=False, loadknowledge=None):
+    pool = multiprocessing.Pool(workers, startworker, (loadknowledge,))
+    try:
+        if not frozen:
+            # Every problem can go to any worker at once
+            tasks = [(problem, None) for problemset in sets for problem in problemset.getProblems()]
+            solved = pool.map(solveproblem, tasks, 1)
+            results = []
+            for problemset in sets:
+                results.append(solved[:len(problemset.getProblems())])
+                solved = solved[len(problemset.getProblems()):]
+            return results, None
+        # Keep the knowledge base here, and only update it between sets
+        base = knowledgebase.loadsnapshot(loadknowledge) or {}
+        results = []
+        for problemset in sets:
+            tasks = [(problem, base) for problem in problemset.getProblems()]
+            setresults = pool.map(solveproblem, tasks, 1)
+            # Learn from the problems in the same order they would have been solved in
+            for answer, timings, learned in setresults:
+                if learned:
+                    knowledgebase.mergeknowledge(base, learned)
+            if 'attributes' in base:
+                knowledgebase.updateknowledge(base)
+            results.append(setresults)
+        return results, base
+    finally:
+        pool.close()
+        pool.join()
+
+# Solve the problem sets and write Results.txt in the same format as the Project drivers
+# When frozen, the final knowledge base can be saved as a snapshot to saveknowledge
+def run(visual=False, workers=None, frozen=False, resultspath='Results.txt', loadknowledge=None, saveknowledge=None):
+    workers = workers or multiprocessing.cpu_count()
+    sets = loadsets(visual)
+    results, base = solvesets(sets, workers, frozen, loadknowledge)
+    if saveknowledge and base is not None:
+        knowledgebase.savesnapshot(base, saveknowledge)
+    resultsfile = open(resultspath, 'w')
+    for problemset, setresults in zip(sets, results):
+        resultsfile.write('%s\n' % problemset.getName())
+        resultsfile.write('%s\n' % '-----------')
+        for problem, (answer, timings, learned) in zip(problemset.getProblems(), setresults):
+            # The problems here weren't solved, so give them the workers' answers
+            problem.setAnswerReceived(answer)
+            result = problem.getName() + ': ' + problem.getGivenAnswer() + ' ' + problem.getCorrect() + ' (Correct Answer: ' + problem.checkAnswer('') + ')'
+            resultsfile.write('%s\n' % result)
+            if timings:
+                instrumentation.timings.problems.append(timings)
+                # Add the problem to the run totals too
+                instrumentation.merge(timings['stages'], timings.get('counters'))
+        resultsfile.write('\n')
+    resultsfile.close()
+    # Write the stage timings of every problem, in order
+    instrumentation.save()
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Solve the Raven's problem sets in parallel")
+    parser.add_argument('--visual', action='store_true', help='solve the visual problems (Project 3 and 4) instead of the verbal ones')
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--frozen', action='store_true', help='solve sets in order, with the knowledge base frozen within each set')
+    parser.add_argument('--results', default='Results.txt', help='results file (default: Results.txt)')
+    parser.add_argument('--load-knowledge', help='knowledge base snapshot for the workers to start from')
+    parser.add_argument('--save-knowledge', help='save the final knowledge base snapshot here (needs --frozen)')
+    options = parser.parse_args(args)
+    if options.save_knowledge and not options.frozen:
+        parser.error('--save-knowledge needs --frozen, the workers of a sharded run each learn separately')
+    run(options.visual, options.workers, options.frozen, options.results, options.load_knowledge, options.save_knowledge)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
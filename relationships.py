@@ -0,0 +1,54 @@
+# Relationships between the objects of two figures
+# A relationship is compared against other relationships many times while scoring
+# the answers, so it's an immutable record with its hash worked out up front,
+# and sets of relationships can be looked up by hash instead of compared one by one
+
+# The fields of a relationship, in the order they're compared
+FIELDS = ('oldobject', 'newobject', 'oldattribute', 'newattribute', 'type', 'value', 'values')
+
+class Relationship(object):
+    __slots__ = ('oldobject', 'newobject', 'oldattribute', 'newattribute', 'type', 'value', 'values', 'key', 'hash')
+
+    # value is the amount of a modification, values the new values of a newvalues relationship
+    def __init__(self, oldobject, newobject, oldattribute, newattribute, type, value=None, values=None):
+        # Lists of values can't be hashed, a tuple of them compares the same way
+        if isinstance(values, list):
+            values = tuple(values)
+        self.oldobject = oldobject
+        self.newobject = newobject
+        self.oldattribute = oldattribute
+        self.newattribute = newattribute
+        self.type = type
+        self.value = value
+        self.values = values
+        self.key = (oldobject, newobject, oldattribute, newattribute, type, value, values)
+        self.hash = hash(self.key)
+
+    # Make a copy of this relationship with a different type (and value or values)
+    def retype(self, type, value=None, values=None):
+        return Relationship(self.oldobject, self.newobject, self.oldattribute, self.newattribute, type, value, values)
+
+    # Fields can also be read like the keys of a dict, relationship['type']
+    def __getitem__(self, field):
+        if not field in FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        if not isinstance(other, Relationship):
+            return NotImplemented
+        return self.hash == other.hash and self.key == other.key
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    # Show the fields like the dicts relationships used to be, skipping the unset ones
+    def __repr__(self):
+        fields = ['%r: %r' % (field, getattr(self, field)) for field in FIELDS if getattr(self, field) is not None]
+        return '{' + ', '.join(fields) + '}'
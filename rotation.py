@@ -0,0 +1,106 @@
+# Rotate object masks with precomputed lookup tables
+# The results are pixel for pixel the same as rotating an image with Pillow 2.6.1's
+# image.rotate(angle, expand=True) (nearest neighbour, filled with black)
+# Every output pixel's source pixel only depends on the image size and the angle, so
+# the mapping is calculated once per size and angle and reused for every object
+# of that size, and rotating is a single array lookup
+
+# Import standard python libraries
+import math, threading
+from collections import deque
+
+# Import NumPy for array-based image processing
+import numpy
+
+# The most memory the lookup tables can use
+MAX_TABLE_BYTES = 64 * 1024 * 1024
+
+# The lookup tables, keyed by (width, height, angle), and the order they were made in
+tables = {}
+tableorder = deque()
+tablebytes = 0
+tablelock = threading.Lock()
+
+# Calculate where each pixel of a rotated image comes from in the original image
+# This follows Pillow's rotate (which builds an affine matrix) and its affine
+# transform (which steps through the matrix in 16.16 fixed point)
+# Returns the rotated (width, height) and an array of source pixel positions in the
+# flattened original, where width * height stands for pixels outside the original
+def buildtable(size, angle):
+    width, height = size
+    radians = -angle * math.pi / 180
+    matrix = [math.cos(radians), math.sin(radians), 0.0, -math.sin(radians), math.cos(radians), 0.0]
+    def transform(x, y):
+        a, b, c, d, e, f = matrix
+        return a*x + b*y + c, d*x + e*y + f
+    # Find the size of the rotated image, big enough to hold all of the original
+    xs = []
+    ys = []
+    for x, y in ((0, 0), (width, 0), (width, height), (0, height)):
+        x, y = transform(x, y)
+        xs.append(x)
+        ys.append(y)
+    newwidth = int(math.ceil(max(xs)) - math.floor(min(xs)))
+    newheight = int(math.ceil(max(ys)) - math.floor(min(ys)))
+    # Rotate around the center
+    x, y = transform(newwidth / 2.0, newheight / 2.0)
+    matrix[2] = width / 2.0 - x
+    matrix[5] = height / 2.0 - y
+
+    # Step through the output pixels in fixed point, exactly like Pillow
+    def fixed(value):
+        return int(math.floor(value * 65536.0 + 0.5))
+    a, b, c, d, e, f = [fixed(value) for value in matrix]
+    rows = numpy.arange(newheight, dtype=numpy.int32)[:, numpy.newaxis]
+    columns = numpy.arange(newwidth, dtype=numpy.int32)
+    sourcexs = (c + rows*b) + columns*a
+    sourcexs >>= 16
+    sourceys = (f + rows*e) + columns*d
+    sourceys >>= 16
+    # Negative positions become huge when unsigned, so one comparison checks both ends
+    inside = sourcexs.view(numpy.uint32) < width
+    inside &= sourceys.view(numpy.uint32) < height
+    sourceys *= width
+    sourceys += sourcexs
+    table = numpy.where(inside, sourceys, width*height).astype(numpy.intp)
+    return (newwidth, newheight), table
+
+# Get the lookup table for rotating an image of the given size by the given angle
+# Tables are kept until they use too much memory, then the oldest ones are dropped
+def rotationtable(size, angle):
+    global tablebytes
+    key = (size[0], size[1], angle)
+    table = tables.get(key)
+    if table:
+        return table
+    table = buildtable(size, angle)
+    with tablelock:
+        if not key in tables:
+            tables[key] = table
+            tableorder.append(key)
+            tablebytes += table[1].nbytes
+            while tablebytes > MAX_TABLE_BYTES and len(tableorder) > 1:
+                oldtable = tables.pop(tableorder.popleft())
+                tablebytes -= oldtable[1].nbytes
+    return table
+
+# Rotate a mask (an array of booleans) counter-clockwise by the given angle
+# The result is big enough to hold the whole rotated mask, like rotate(expand=True)
+def rotatemask(mask, angle):
+    height, width = mask.shape
+    newsize, table = rotationtable((width, height), angle)
+    # The extra pixel at the end is where everything outside the original comes from
+    source = numpy.zeros(width * height + 1, dtype=bool)
+    source[:-1] = mask.ravel()
+    return source.take(table)
+
+# Rotate a mask and crop it to the set pixels
+# If no pixels are left after rotating, the whole rotated mask is returned
+# (the same as cropping an image to a bounding box of None)
+def rotatecrop(mask, angle):
+    rotated = rotatemask(mask, angle)
+    rows = numpy.nonzero(rotated.any(axis=1))[0]
+    if not len(rows):
+        return rotated
+    columns = numpy.nonzero(rotated.any(axis=0))[0]
+    return rotated[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1]
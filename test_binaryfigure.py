@@ -0,0 +1,84 @@
+# Tests for BinaryFigure
+
+import pickle
+import numpy
+from numpy.random import RandomState
+from PIL import Image, ImageOps
+from binaryfigure import BinaryFigure
+
+class TestBinaryFigure:
+    def setup(self):
+        self.random = RandomState(1337)
+        # Widths on and off a byte boundary
+        self.sizes = [(1, 1), (7, 3), (8, 5), (9, 4), (16, 2), (31, 17), (184, 184)]
+
+    # Make a random black and white image, the way blackandwhite makes them
+    def randomimage(self, size, density=0.3):
+        width, height = size
+        black = self.random.random_sample((height, width)) < density
+        pixels = numpy.where(black, 0, 255).astype(numpy.uint8)
+        return black, Image.fromarray(pixels, 'L').convert('1')
+
+    def test_fromimage(self):
+        for size in self.sizes:
+            black, image = self.randomimage(size)
+            figure = BinaryFigure.fromimage(image)
+            assert figure.size == image.size
+            assert (figure.mask() == black).all()
+            # Grayscale images give the same bits as mode '1' ones
+            assert (BinaryFigure.fromimage(image.convert('L')).bits == figure.bits).all()
+            assert (BinaryFigure.frommask(black).bits == figure.bits).all()
+
+    def test_toimage(self):
+        for size in self.sizes:
+            black, image = self.randomimage(size)
+            figure = BinaryFigure.fromimage(image)
+            assert figure.toimage().tobytes() == image.tobytes()
+            assert figure.toimage('L').tobytes() == image.convert('L').tobytes()
+            assert figure.toinverted().tobytes() == ImageOps.invert(image.convert('L')).tobytes()
+
+    def test_count(self):
+        for size in self.sizes:
+            black, image = self.randomimage(size)
+            assert BinaryFigure.fromimage(image).count() == black.sum()
+
+    def test_getbbox(self):
+        # Boxes are the same as the inverted grayscale image's, which crop used to use
+        for size in self.sizes:
+            for density in (0.0, 0.002, 0.05, 0.5):
+                black, image = self.randomimage(size, density)
+                expected = ImageOps.invert(image.convert('L')).getbbox()
+                assert BinaryFigure.fromimage(image).getbbox() == expected
+
+    def test_crop(self):
+        for size in self.sizes:
+            black, image = self.randomimage(size)
+            width, height = size
+            for trial in range(10):
+                left, right = sorted(self.random.randint(0, width + 1, size=2))
+                upper, lower = sorted(self.random.randint(0, height + 1, size=2))
+                box = (left, upper, right, lower)
+                cropped = BinaryFigure.fromimage(image).crop(box)
+                expected = image.crop(box)
+                assert cropped.size == expected.size
+                assert (cropped.mask() == (numpy.asarray(expected.convert('L')) != 255)).all()
+
+    def test_contenthash(self):
+        black, image = self.randomimage((31, 17))
+        figure = BinaryFigure.fromimage(image)
+        assert figure.contenthash() == BinaryFigure.frommask(black.copy()).contenthash()
+        changed = black.copy()
+        changed[5, 30] = not changed[5, 30]
+        assert figure.contenthash() != BinaryFigure.frommask(changed).contenthash()
+        # The same bits in a different shape are a different figure
+        empty = numpy.zeros((4, 8), dtype=bool)
+        assert BinaryFigure.frommask(empty).contenthash() != BinaryFigure.frommask(empty.reshape(8, 4)).contenthash()
+
+    def test_pickle(self):
+        for size in self.sizes:
+            black, image = self.randomimage(size)
+            figure = BinaryFigure.fromimage(image)
+            copy = pickle.loads(pickle.dumps(figure, pickle.HIGHEST_PROTOCOL))
+            assert copy.size == figure.size
+            assert (copy.mask() == black).all()
+            assert copy.contenthash() == figure.contenthash()
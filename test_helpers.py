@@ -0,0 +1,62 @@
+# Tests for bestassignment in helpers
+
+import random, itertools
+from helpers import bestassignment
+
+# Find the best total weight by trying every assignment of the smaller side to the larger one
+def bruteforce(weights):
+    rowcount = len(weights)
+    columncount = len(weights[0]) if weights else 0
+    if not rowcount or not columncount:
+        return None
+    if rowcount <= columncount:
+        return max(sum(weights[row][columns[row]] for row in range(rowcount)) for columns in itertools.permutations(range(columncount), rowcount))
+    return max(sum(weights[rows[column]][column] for column in range(columncount)) for rows in itertools.permutations(range(rowcount), columncount))
+
+class TestBestAssignment:
+    def setup(self):
+        self.random = random.Random(1337)
+
+    def check_assignment(self, weights):
+        pairs = bestassignment(weights)
+        best = bruteforce(weights)
+        if best is None:
+            assert pairs == []
+            return
+        rows = [row for row, column in pairs]
+        columns = [column for row, column in pairs]
+        # Every row or every column is used once, whichever there are fewer of
+        assert len(pairs) == min(len(weights), len(weights[0]))
+        assert len(set(rows)) == len(rows)
+        assert len(set(columns)) == len(columns)
+        assert pairs == sorted(pairs)
+        assert sum(weights[row][column] for row, column in pairs) == best
+
+    def test_empty(self):
+        assert bestassignment([]) == []
+        assert bestassignment([[], []]) == []
+
+    def test_single(self):
+        assert bestassignment([[5]]) == [(0, 0)]
+        assert bestassignment([[1, 7, 3]]) == [(0, 1)]
+        assert bestassignment([[1], [7], [3]]) == [(1, 0)]
+
+    def test_greedy_is_wrong(self):
+        # Taking the biggest weight first gives 10, the best assignment gives 16
+        assert bestassignment([[9, 8], [8, 1]]) == [(0, 1), (1, 0)]
+
+    def test_random(self):
+        for trial in range(1000):
+            rowcount, columncount = self.random.randint(1, 6), self.random.randint(1, 6)
+            self.check_assignment([[self.random.randint(0, 20) for column in range(columncount)] for row in range(rowcount)])
+
+    def test_ties(self):
+        # Lots of equal weights, like objects that match equally well
+        for trial in range(300):
+            rowcount, columncount = self.random.randint(1, 5), self.random.randint(1, 5)
+            self.check_assignment([[self.random.randint(0, 2) for column in range(columncount)] for row in range(rowcount)])
+
+    def test_negative(self):
+        for trial in range(200):
+            rowcount, columncount = self.random.randint(1, 5), self.random.randint(1, 5)
+            self.check_assignment([[self.random.randint(-10, 10) for column in range(columncount)] for row in range(rowcount)])
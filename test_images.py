@@ -0,0 +1,94 @@
+# Tests for labelobjects in images
+
+import numpy
+from numpy.random import RandomState
+from PIL import Image
+from images import labelobjects
+from binaryfigure import BinaryFigure
+
+# Label the objects the way colorize used to, by flood filling from the first black pixel left
+# Returns the same label array and object stats as labelobjects
+def floodlabels(mask):
+    height, width = mask.shape
+    labels = numpy.zeros((height, width), dtype=numpy.int32)
+    objects = []
+    for y in range(height):
+        for x in range(width):
+            if not mask[y, x] or labels[y, x]:
+                continue
+            label = len(objects) + 1
+            labels[y, x] = label
+            pixels = [(x, y)]
+            neighbors = [(x, y)]
+            # Keep finding 4-connected black neighbors until there are none left
+            while neighbors:
+                processing = neighbors
+                neighbors = []
+                for nx, ny in processing:
+                    for px, py in ((nx-1, ny), (nx+1, ny), (nx, ny-1), (nx, ny+1)):
+                        if px < 0 or px >= width or py < 0 or py >= height:
+                            continue
+                        if not mask[py, px] or labels[py, px]:
+                            continue
+                        labels[py, px] = label
+                        pixels.append((px, py))
+                        neighbors.append((px, py))
+            xs = [px for px, py in pixels]
+            ys = [py for px, py in pixels]
+            objects.append({'label':label, 'area':len(pixels), 'box':(min(xs), min(ys), max(xs) + 1, max(ys) + 1), 'first':(x, y)})
+    return labels, objects
+
+class TestLabelObjects:
+    def setup(self):
+        self.random = RandomState(1337)
+
+    # Make a random mask, sparse enough to have lots of separate objects
+    def randommask(self, width, height, density):
+        return self.random.random_sample((height, width)) < density
+
+    def check_labels(self, mask):
+        labels, objects = labelobjects(BinaryFigure.frommask(mask))
+        expectedlabels, expectedobjects = floodlabels(mask)
+        assert (labels == expectedlabels).all()
+        assert objects == expectedobjects
+
+    def test_empty(self):
+        labels, objects = labelobjects(BinaryFigure.frommask(numpy.zeros((7, 9), dtype=bool)))
+        assert objects == []
+        assert labels.shape == (7, 9)
+        assert not labels.any()
+
+    def test_full(self):
+        self.check_labels(numpy.ones((5, 13), dtype=bool))
+
+    def test_joined_below(self):
+        # A U shape, the two arms are only joined on the last row
+        mask = numpy.zeros((6, 7), dtype=bool)
+        mask[:, 1] = True
+        mask[:, 5] = True
+        mask[5, 1:6] = True
+        self.check_labels(mask)
+        labels, objects = labelobjects(BinaryFigure.frommask(mask))
+        assert len(objects) == 1
+
+    def test_diagonal(self):
+        # Pixels that only touch at the corners are separate objects
+        mask = numpy.eye(6, dtype=bool)
+        self.check_labels(mask)
+        labels, objects = labelobjects(BinaryFigure.frommask(mask))
+        assert len(objects) == 6
+
+    def test_random(self):
+        for trial in range(200):
+            width, height = self.random.randint(1, 40, size=2)
+            self.check_labels(self.randommask(width, height, self.random.uniform(0.1, 0.7)))
+
+    def test_image(self):
+        # PIL images are labeled the same as their figures, anything not pure white is black
+        mask = self.randommask(23, 17, 0.4)
+        pixels = numpy.where(mask, self.random.randint(0, 255, size=mask.shape), 255).astype(numpy.uint8)
+        image = Image.fromarray(pixels, 'L')
+        labels, objects = labelobjects(image)
+        expectedlabels, expectedobjects = floodlabels(mask)
+        assert (labels == expectedlabels).all()
+        assert objects == expectedobjects
@@ -0,0 +1,91 @@
+# Tests for mergeknowledge in knowledgebase
+
+import random
+from collections import OrderedDict
+import knowledgebase
+
+ATTRIBUTES = ['shape', 'size', 'fill', 'angle', 'inside', 'above', 'left-of', 'vertical-flip']
+VALUES = ['circle', 'square', 'triangle', 'small', 'large', 'yes', 'no', '0', '45', '90']
+FIGURES = ['A', 'B', 'C', '1', '2', '3', '4', '5', '6']
+
+# A simple stand in for Agent.diff_features, one diff for each attribute of the second figure
+def differ(figure, otherfigure):
+    diffs = []
+    for objectname, object in sorted(otherfigure.items()):
+        for attribute, values in sorted(object.items()):
+            before = figure.get(objectname, {}).get(attribute)
+            type = 'unchanged' if before == values else 'changed'
+            diffs.append({'type':type, 'feature':{'object':objectname, 'attribute':attribute}})
+    return diffs
+
+class TestMergeKnowledge:
+    def setup(self):
+        self.random = random.Random(1337)
+
+    # Make a problem with random objects, some of whose values refer to other objects
+    def randomproblem(self):
+        objectnames = [chr(ord('Z') - index) for index in range(self.random.randint(1, 4))]
+        figures = {}
+        for figurename in FIGURES:
+            figure = {}
+            for objectname in objectnames:
+                object = {}
+                for attribute in self.random.sample(ATTRIBUTES, self.random.randint(1, 4)):
+                    choices = VALUES + objectnames
+                    object[attribute] = self.random.sample(choices, self.random.randint(1, 3))
+                figure[objectname] = object
+            figures[figurename] = figure
+        return {'figures':figures, 'type':self.random.choice(['2x1', '2x2', '3x3'])}
+
+    # Learn from a problem, the way Agent does after solving it
+    def learn(self, kb, prob):
+        knowledgebase.scanattributes(kb, prob)
+        knowledgebase.analyzeanswer(kb, prob, self.random.choice(FIGURES[3:]), differ)
+
+    def check_merge(self, problems, chunks):
+        # Learn from every problem in order
+        self.random.seed(len(problems))
+        expected = {}
+        for prob in problems:
+            self.learn(expected, prob)
+        # Learn from each chunk of problems separately, then merge them in order
+        self.random.seed(len(problems))
+        merged = {}
+        start = 0
+        for size in chunks:
+            # Keep the attributes in the order they were found, like parallelrunner does
+            learned = {'attributes':OrderedDict()}
+            for prob in problems[start:start + size]:
+                self.learn(learned, prob)
+            knowledgebase.mergeknowledge(merged, learned)
+            start += size
+        assert merged == expected
+        # The lists of values are in the same order too
+        for attribute, info in expected.get('attributes', {}).items():
+            assert merged['attributes'][attribute]['values'] == info['values']
+        if expected:
+            knowledgebase.updateknowledge(expected)
+            knowledgebase.updateknowledge(merged)
+            assert merged == expected
+
+    def test_one_at_a_time(self):
+        problems = [self.randomproblem() for index in range(30)]
+        self.check_merge(problems, [1] * len(problems))
+
+    def test_chunks(self):
+        for trial in range(50):
+            problems = [self.randomproblem() for index in range(self.random.randint(1, 20))]
+            chunks = []
+            while sum(chunks) < len(problems):
+                chunks.append(self.random.randint(1, len(problems) - sum(chunks)))
+            self.check_merge(problems, chunks)
+
+    def test_into_existing(self):
+        # Merging into a knowledge base that already knows something, like a loaded snapshot
+        problems = [self.randomproblem() for index in range(12)]
+        self.check_merge(problems, [7, 5])
+
+    def test_empty(self):
+        merged = {}
+        knowledgebase.mergeknowledge(merged, {})
+        assert merged == {}
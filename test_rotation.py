@@ -0,0 +1,93 @@
+# Tests for rotation, which has to match Pillow 2.6.1's rotate(expand=True)
+
+from unittest import SkipTest
+import numpy
+from numpy.random import RandomState
+import PIL
+from PIL import Image
+import rotation
+
+# A small mask rotated by Pillow 2.6.1, so the tables are checked whichever Pillow is installed
+# Pillow 2.6.1's expanded sizes are a pixel off for some angles, and the tables copy that
+MASK = ['##...', '#....', '####.']
+ROTATED = {
+    0: ['##...', '#....', '####.'],
+    30: ['.......', '.......', '.......', '.##..#.', '..###..', '..##...'],
+    45: ['.......', '.......', '.......', '..#..#.', '.##.#..', '..##...'],
+    90: ['....', '....', '...#', '...#', '.#.#'],
+    135: ['......', '......', '...#..', '....#.', '.....#', '...###', '....#.'],
+    200: ['.......', '....##.', '..##.#.', '.....##', '.......'],
+}
+
+# Turn rows of '#' (set) and '.' (clear) into a mask
+def parsemask(rows):
+    return numpy.array([[pixel == '#' for pixel in row] for row in rows])
+
+# Rotate a mask the way findsymmetry and findangleoffset used to, as an inverted image
+# Other Pillow versions rotate differently, so those comparisons only run with Pillow 2.6.1
+def rotateimage(mask, angle):
+    if PIL.PILLOW_VERSION != '2.6.1':
+        raise SkipTest('needs Pillow 2.6.1, found %s' % PIL.PILLOW_VERSION)
+    inverted = Image.fromarray(numpy.where(mask, 255, 0).astype(numpy.uint8), 'L')
+    return inverted.rotate(angle, expand=True)
+
+class TestRotation:
+    def setup(self):
+        self.random = RandomState(1337)
+        # Angles findangleoffset tries, plus some awkward ones
+        self.angles = [0, 1, 15, 30, 45, 60, 89, 90, 135, 180, 225, 270, 315, 359, -30, 22.5]
+
+    def randommask(self, width, height):
+        return self.random.random_sample((height, width)) < self.random.uniform(0.05, 0.9)
+
+    def check_rotation(self, mask, angle):
+        expected = rotateimage(mask, angle)
+        rotated = rotation.rotatemask(mask, angle)
+        assert rotated.shape == (expected.size[1], expected.size[0])
+        assert (rotated == (numpy.asarray(expected) == 255)).all()
+
+    def test_stored(self):
+        for angle, rows in sorted(ROTATED.items()):
+            rotated = rotation.rotatemask(parsemask(MASK), angle)
+            assert rotated.shape == parsemask(rows).shape
+            assert (rotated == parsemask(rows)).all()
+
+    def test_rotatemask(self):
+        for angle in self.angles:
+            for size in ((1, 1), (2, 3), (17, 17), (40, 23), (23, 40)):
+                self.check_rotation(self.randommask(*size), angle)
+
+    def test_random(self):
+        for trial in range(300):
+            width, height = self.random.randint(1, 60, size=2)
+            self.check_rotation(self.randommask(width, height), self.random.randint(0, 360))
+
+    def test_rotatecrop(self):
+        for trial in range(100):
+            width, height = self.random.randint(1, 40, size=2)
+            mask = self.randommask(width, height)
+            angle = self.random.randint(0, 360)
+            expected = rotateimage(mask, angle)
+            expected = expected.crop(expected.getbbox())
+            cropped = rotation.rotatecrop(mask, angle)
+            assert (cropped == (numpy.asarray(expected) == 255)).all()
+
+    def test_rotatecrop_empty(self):
+        # Nothing to crop to, so the whole rotated mask comes back
+        mask = numpy.zeros((5, 9), dtype=bool)
+        cropped = rotation.rotatecrop(mask, 30)
+        expected = rotateimage(mask, 30)
+        assert cropped.shape == (expected.size[1], expected.size[0])
+        assert not cropped.any()
+
+    def test_tables_bounded(self):
+        # Tables are dropped oldest first once they use too much memory
+        saved = rotation.MAX_TABLE_BYTES
+        rotation.MAX_TABLE_BYTES = 1
+        try:
+            for angle in (10, 20, 30):
+                rotation.rotatemask(self.randommask(30, 30), angle)
+            assert len(rotation.tables) == 1
+            assert rotation.tablebytes == rotation.tables[(30, 30, 30)][1].nbytes
+        finally:
+            rotation.MAX_TABLE_BYTES = saved